@@ -0,0 +1,45 @@
+import asyncio
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from config import DB_POOL_SIZE
+from database import Database
+
+# Dedicated threads for database work, one per pooled connection
+_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="db")
+
+
+async def run_in_db_thread(func, *args, **kwargs):
+    """Runs a blocking callable on the database executor and awaits its result"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, partial(func, *args, **kwargs))
+
+
+class AsyncDatabase:
+    """
+    Async counterpart of Database.
+    Every public Database method is available as a coroutine with the same arguments:
+
+        db = AsyncDatabase(DB_NAME)
+        user_ids = await db.get_user_ids()
+
+    Each call checks out a pooled connection on the database executor, so the event loop
+    never waits for SQLite and no connection is held while a handler talks to Telegram.
+    """
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+
+    def _call(self, method_name: str, *args, **kwargs):
+        with Database(self.db_file) as db:
+            return getattr(db, method_name)(*args, **kwargs)
+
+    def __getattr__(self, name: str):
+        if name.startswith("_") or not callable(getattr(Database, name, None)):
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+        async def method(*args, **kwargs):
+            return await run_in_db_thread(self._call, name, *args, **kwargs)
+
+        method.__name__ = name
+        return method
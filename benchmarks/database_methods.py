@@ -0,0 +1,298 @@
+"""
+Times every Database method on synthetic databases of several sizes and compares the results
+with a JSON baseline, so schema and query changes can be judged with numbers.
+
+    python -m benchmarks.database_methods [--scales small medium large] [--repeat 20]
+                                          [--baseline FILE] [--update-baseline] [--threshold 0.25]
+
+The first run (or --update-baseline) records the medians to the baseline file. Later runs exit
+with code 1 if a method got slower than its baseline by more than the threshold (0.25 = 25%).
+Baselines depend on the machine, so record and compare them on the same one.
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+from datetime import date, timedelta
+
+from database import Database
+
+# users, current schedules, queue entries in them and years of Archive history
+SCALES = {
+    "small": dict(users=200, schedules=50, queue_entries=500, archive_years=1),
+    "medium": dict(users=2000, schedules=300, queue_entries=5000, archive_years=3),
+    "large": dict(users=10000, schedules=1000, queue_entries=20000, archive_years=10),
+}
+
+POSITIONS_PER_QUEUE = 25
+SUBGROUPS = ("1", "2")
+TODAY = date(2025, 9, 1)  # fixed, so every run builds the same data
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "database_methods_baseline.json")
+
+# Differences below this are timer noise, not regressions
+MIN_REGRESSION_MS = 0.05
+
+
+def db_date(day: date) -> str:
+    return day.strftime("%Y-%m-%d")
+
+
+def file_date(day: date) -> str:
+    return day.strftime("%d.%m.%y")
+
+
+def build(db_file: str, users: int, schedules: int, queue_entries: int, archive_years: int) -> dict:
+    """
+    Fills a fresh database and returns the sample ids the benchmarks work with.
+    Current schedules are spread over the next 120 days, every one of them open; queue entries fill
+    them position by position. Each year of history has as many schedules as the current term,
+    all closed, with full queues in Archive.
+    """
+    rng = random.Random(42)
+
+    current = [(f"Subject {i // len(SUBGROUPS)}", SUBGROUPS[i % len(SUBGROUPS)], db_date(TODAY + timedelta(days=i % 120)))
+               for i in range(schedules)]
+    past = [(f"Old subject {i}", rng.choice(SUBGROUPS), db_date(TODAY - timedelta(days=rng.randint(1, 365 * archive_years))))
+            for i in range(schedules * archive_years)]
+
+    with Database(db_file) as db:
+        db.create_database()
+        db.execute("INSERT INTO Settings (registration_enabled) VALUES (1)")
+        db.execute_many("INSERT INTO Users (user_id, full_name, is_blocked) VALUES (?, ?, ?)",
+                        [(user_id, f"User {user_id}", int(user_id % 50 == 0)) for user_id in range(1, users + 1)])
+
+        db.execute_many("INSERT INTO Schedules (subject, subgroup, defense_date) VALUES (?, ?, ?)", past + current)
+        rows = db.fetch("SELECT id, defense_date FROM Schedules ORDER BY id")
+        past_ids = [schedule_id for schedule_id, _ in rows[:len(past)]]
+        current_ids = [schedule_id for schedule_id, _ in rows[len(past):]]
+
+        db.execute_many("INSERT INTO Active_Queues (schedule_id, is_open) VALUES (?, 0)", [(i,) for i in past_ids])
+        db.open_active_queues(current_ids)
+
+        queue_entries = min(queue_entries, len(current_ids) * POSITIONS_PER_QUEUE)
+        db.execute_many("INSERT INTO Queues (schedule_id, user_id, lab_number, position) VALUES (?, ?, ?, ?)",
+                        [(current_ids[i % len(current_ids)], rng.randint(1, users), i + 1,
+                          i // len(current_ids) + 1)
+                         for i in range(queue_entries)])
+
+        db.execute_many("INSERT INTO Archive (schedule_id, user_id, lab_number, position) VALUES (?, ?, ?, ?)",
+                        [(schedule_id, rng.randint(1, users), rng.randint(1, 10), position)
+                         for schedule_id in past_ids for position in range(1, POSITIONS_PER_QUEUE + 1)])
+
+        # A finished broadcast to everyone, as the outbox looks most of the time
+        db.enqueue_messages([(user_id, "Оголошення", None) for user_id in range(1, users + 1)], (1, 1))
+        db.execute("UPDATE Outbox SET status = 'sent', attempts = 1")
+
+        busiest_user = db.fetch("SELECT user_id FROM Queues GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1")[0][0]
+        partly_free = db.fetch(f"""SELECT schedule_id FROM Queues GROUP BY schedule_id
+                                   HAVING COUNT(*) < {POSITIONS_PER_QUEUE} ORDER BY COUNT(*) DESC LIMIT 1""")
+
+    return {
+        "user_id": busiest_user,
+        "schedule_id": current_ids[0],
+        "free_schedule_id": partly_free[0][0] if partly_free else current_ids[-1],
+        "date": current[0][2],
+        "schedules": current + past,  # current first, so they are the ones moved in schedules.json
+    }
+
+
+def write_schedules_file(filename: str, schedules: list[tuple], moved: int = 0):
+    """Writes schedules.json with the schedules; the first `moved` of them get a date a week later"""
+    data = {}
+    for i, (subject, subgroup, defense_date) in enumerate(schedules):
+        day = date.fromisoformat(defense_date) + timedelta(days=7 if i < moved else 0)
+        data.setdefault(subgroup, {}).setdefault(subject, []).append(file_date(day))
+    with open(filename, "w") as f:
+        json.dump(data, f)
+
+
+def free_position(db: Database, schedule_id: int) -> int:
+    taken = set(db.get_taken_positions(schedule_id))
+    return next(p for p in range(1, POSITIONS_PER_QUEUE + 100) if p not in taken)
+
+
+# (name, run(db, ctx), prepare, reset)
+# prepare and reset are untimed and run before / after every run: None for reads, a function
+# that sets up or undoes the write, or RESTORE to copy the whole database back from the snapshot
+# taken after building it
+RESTORE = "restore"
+
+
+def benchmarks(directory: str) -> list[tuple]:
+    schedules_file = os.path.join(directory, "schedules.json")
+    moved_file = os.path.join(directory, "schedules_moved.json")
+
+    def pick_free_position(db, ctx):
+        ctx["free_position"] = free_position(db, ctx["free_schedule_id"])
+
+    def add_user(db, ctx):
+        db.add_user_to_queue(ctx["free_schedule_id"], ctx["user_id"], 999, ctx["free_position"])
+
+    def remove_user(db, ctx):
+        db.remove_user_from_queue(ctx["free_schedule_id"], ctx["user_id"], 999)
+
+    def add_user_at_free_position(db, ctx):
+        pick_free_position(db, ctx)
+        add_user(db, ctx)
+
+    def archive_one_day(db, ctx):
+        db.archive_past_queues(ctx["date"])
+
+    def archive_whole_term(db, ctx):
+        db.archive_past_queues(db_date(TODAY + timedelta(days=120)))
+
+    return [
+        ("get_queue_for_schedule", lambda db, ctx: db.get_queue_for_schedule(ctx["schedule_id"]), None, None),
+        ("get_queue_with_users", lambda db, ctx: db.get_queue_with_users(ctx["schedule_id"]), None, None),
+        ("get_user_queues", lambda db, ctx: db.get_user_queues(ctx["user_id"]), None, None),
+        ("get_current_active_queues", lambda db, ctx: db.get_current_active_queues(), None, None),
+        ("get_taken_positions", lambda db, ctx: db.get_taken_positions(ctx["schedule_id"]), None, None),
+        ("get_queue_slots", lambda db, ctx: db.get_queue_slots(ctx["schedule_id"]), None, None),
+        ("is_position_taken", lambda db, ctx: db.is_position_taken(ctx["schedule_id"], 1), None, None),
+        ("is_same_user_in_queue", lambda db, ctx: db.is_same_user_in_queue(ctx["user_id"], ctx["schedule_id"], 1), None, None),
+        ("get_next_position", lambda db, ctx: db.get_next_position(ctx["schedule_id"]), None, None),
+        ("get_subject_name_and_subgroup", lambda db, ctx: db.get_subject_name_and_subgroup(ctx["schedule_id"]), None, None),
+        ("get_schedules_for_date", lambda db, ctx: db.get_schedules_for_date(ctx["date"]), None, None),
+        ("get_schedules_with_subjects_for_date",
+         lambda db, ctx: db.get_schedules_with_subjects_for_date(ctx["date"]), None, None),
+        ("is_registration_enabled", lambda db, ctx: db.is_registration_enabled(), None, None),
+        ("is_user_registered", lambda db, ctx: db.is_user_registered(ctx["user_id"]), None, None),
+        ("get_all_user_ids", lambda db, ctx: db.get_all_user_ids(), None, None),
+        ("get_user_ids", lambda db, ctx: db.get_user_ids(), None, None),
+        ("get_due_messages", lambda db, ctx: db.get_due_messages(100), None, None),
+        ("get_batches_progress", lambda db, ctx: db.get_batches_progress([1]), None, None),
+        ("get_meta", lambda db, ctx: db.get_meta("schedules_hash"), None, None),
+        ("seed_schedules (unchanged file)", lambda db, ctx: db.seed_schedules(schedules_file), None, None),
+
+        ("add_user_to_queue", add_user, pick_free_position, remove_user),
+        ("remove_user_from_queue", remove_user, add_user_at_free_position, None),
+        ("register_user", lambda db, ctx: db.register_user(10 ** 9, "New User"), None,
+         lambda db, ctx: db.execute("DELETE FROM Users WHERE user_id = ?", (10 ** 9,))),
+        ("toggle_registration", lambda db, ctx: db.toggle_registration(), None,
+         lambda db, ctx: db.toggle_registration()),
+        ("mark_users_blocked", lambda db, ctx: db.mark_users_blocked(list(range(1, 101))), None,
+         lambda db, ctx: db.execute("UPDATE Users SET is_blocked = 0 WHERE user_id <= 100 AND user_id % 50 != 0")),
+        ("open_active_queues", lambda db, ctx: db.open_active_queues([ctx["schedule_id"]]), None, None),
+        ("close_active_queue", lambda db, ctx: db.close_active_queue(ctx["schedule_id"]), None,
+         lambda db, ctx: db.open_active_queues([ctx["schedule_id"]])),
+        ("reschedule_queue", lambda db, ctx: db.reschedule_queue(ctx["schedule_id"], "01.01.30"), RESTORE, None),
+        ("insert_defense_dates", lambda db, ctx: db.insert_defense_dates("Benchmark", "1", "01.01.30"), None,
+         lambda db, ctx: db.execute("DELETE FROM Schedules WHERE subject = 'Benchmark'")),
+        ("enqueue_messages (100)", lambda db, ctx: db.enqueue_messages([(1, "Тест", None)] * 100), None,
+         lambda db, ctx: db.execute("DELETE FROM Outbox WHERE status = 'pending'")),
+        ("purge_outbox", lambda db, ctx: db.purge_outbox(0), RESTORE, None),
+        ("archive_past_queues (one day)", archive_one_day, RESTORE, None),
+        ("archive_past_queues (whole term)", archive_whole_term, RESTORE, None),
+        ("sync_schedules (10 moved)", lambda db, ctx: db.sync_schedules(moved_file), RESTORE, None),
+    ]
+
+
+def restore(snapshot: str, db: Database):
+    with sqlite3.connect(snapshot) as source:
+        source.backup(db.conn)
+    # The copy went through the WAL; checkpoint it now, so the next timed write doesn't
+    db.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+def run_scale(scale: str, repeat: int) -> dict[str, float]:
+    """Builds the database for the scale and returns the median time of every method in ms"""
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        db_file = os.path.join(directory, f"{scale}.db")
+        snapshot = os.path.join(directory, f"{scale}_snapshot.db")
+
+        started = time.perf_counter()
+        ctx = build(db_file, **SCALES[scale])
+        write_schedules_file(os.path.join(directory, "schedules.json"), ctx["schedules"])
+        write_schedules_file(os.path.join(directory, "schedules_moved.json"), ctx["schedules"], moved=10)
+
+        with Database(db_file) as db:
+            db.seed_schedules(os.path.join(directory, "schedules.json"))
+            with sqlite3.connect(snapshot) as target:
+                db.conn.backup(target)
+        print(f"\n[{scale}] {SCALES[scale]}, побудовано за {time.perf_counter() - started:.1f} с")
+
+        with Database(db_file) as db:
+            for name, run, prepare, reset in benchmarks(directory):
+                # Restoring the whole database is slow, so those get fewer runs
+                runs = max(3, repeat // 4) if prepare == RESTORE else repeat
+                timings = []
+                for _ in range(runs):
+                    if prepare == RESTORE:
+                        restore(snapshot, db)
+                    elif prepare:
+                        prepare(db, ctx)
+
+                    started = time.perf_counter()
+                    run(db, ctx)
+                    timings.append((time.perf_counter() - started) * 1000)
+
+                    if callable(reset):
+                        reset(db, ctx)
+
+                if prepare == RESTORE:
+                    restore(snapshot, db)
+
+                results[name] = statistics.median(timings)
+                print(f"  {name:<40} {results[name]:>9.3f} мс")
+
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Returns descriptions of the methods that got slower than their baseline beyond the threshold"""
+    regressions = []
+    for scale, methods in results.items():
+        for name, current_ms in methods.items():
+            baseline_ms = baseline.get(scale, {}).get(name)
+            if baseline_ms is None:
+                continue
+            if current_ms > baseline_ms * (1 + threshold) and current_ms - baseline_ms > MIN_REGRESSION_MS:
+                regressions.append(f"[{scale}] {name}: {baseline_ms:.3f} мс -> {current_ms:.3f} мс "
+                                   f"(+{(current_ms / baseline_ms - 1) * 100:.0f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", nargs="+", choices=SCALES, default=list(SCALES))
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--update-baseline", action="store_true", help="record this run as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown, 0.25 = 25%%")
+    args = parser.parse_args()
+
+    results = {scale: run_scale(scale, args.repeat) for scale in args.scales}
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    if args.update_baseline or not baseline:
+        # Scales that were not run this time keep their old numbers
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, ensure_ascii=False, sort_keys=True)
+        print(f"\nБазові значення записано в {args.baseline}")
+        return
+
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"\nПовільніше за базові значення більш ніж на {args.threshold * 100:.0f}%:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+
+    print("\nРегресій немає")
+
+
+if __name__ == "__main__":
+    main()
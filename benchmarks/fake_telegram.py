@@ -0,0 +1,227 @@
+"""
+In-process stand-in for the Telegram Bot API, for running the real Application without a network.
+
+Point the bot at it with build_application(base_url=fake.base_url), then inject updates with
+push_message / push_callback and await the bot's answers with wait_for_response.
+Both delivery modes work: getUpdates long polling and webhooks registered through setWebhook.
+api_delay adds a simulated network round-trip to every call except getUpdates.
+"""
+import asyncio
+import itertools
+import json
+import time
+
+from urllib.parse import parse_qsl, urlsplit
+
+import httpx
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Queue Bot", "username": "queue_bot"}
+
+# Methods whose result is a Message; the rest answer True
+MESSAGE_METHODS = {"sendMessage", "editMessageText", "editMessageReplyMarkup"}
+RESPONSE_METHODS = MESSAGE_METHODS | {"answerCallbackQuery"}
+
+
+class FakeTelegram:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, api_delay: float = 0):
+        self.host = host
+        self.port = port
+        self.api_delay = api_delay
+
+        self.updates = []  # pending updates for getUpdates
+        self.calls = []  # (time, method, params) of every Bot API call
+        self.webhook_url = None
+        self.webhook_secret = None
+
+        self._server = None
+        self._client = None
+        self._new_update = asyncio.Event()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1000)
+        self._callback_users = {}  # callback query id -> user id
+        self._responses = {}  # chat_id -> asyncio.Queue of (time, method, params)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/bot"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._client = httpx.AsyncClient()
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+        await self._client.aclose()
+
+    # Updates sent to the bot
+
+    @staticmethod
+    def _user(user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"}
+
+    @staticmethod
+    def _chat(chat_id: int) -> dict:
+        return {"id": chat_id, "type": "private", "first_name": f"User {chat_id}"}
+
+    async def push_message(self, user_id: int, text: str) -> float:
+        """Sends a text message (or a /command) from the user, returns the time it was pushed"""
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": self._chat(user_id),
+            "from": self._user(user_id),
+            "text": text,
+        }
+        if text.startswith("/"):
+            command_length = len(text.split()[0])
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": command_length}]
+        return await self._push({"message": message})
+
+    async def push_callback(self, user_id: int, data: str, message_id: int = None) -> float:
+        """Taps an inline button with callback data under a bot message, returns the time it was pushed"""
+        callback_id = str(next(self._update_ids) * 7919)
+        self._callback_users[callback_id] = user_id
+        callback_query = {
+            "id": callback_id,
+            "from": self._user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": message_id or next(self._message_ids),
+                "date": int(time.time()),
+                "chat": self._chat(user_id),
+                "from": BOT_USER,
+                "text": "menu",
+            },
+        }
+        return await self._push({"callback_query": callback_query})
+
+    async def _push(self, update: dict) -> float:
+        update["update_id"] = next(self._update_ids)
+        pushed_at = time.perf_counter()
+
+        if self.webhook_url:
+            headers = {"X-Telegram-Bot-Api-Secret-Token": self.webhook_secret or ""}
+            await self._client.post(self.webhook_url, json=update, headers=headers)
+        else:
+            self.updates.append(update)
+            self._new_update.set()
+        return pushed_at
+
+    # Answers from the bot
+
+    def _responses_for(self, chat_id: int) -> asyncio.Queue:
+        if chat_id not in self._responses:
+            self._responses[chat_id] = asyncio.Queue()
+        return self._responses[chat_id]
+
+    async def wait_for_response(self, chat_id: int, timeout: float = 10) -> tuple[float, str, dict]:
+        """Waits for the next sendMessage / editMessageText / answerCallbackQuery aimed at the chat"""
+        return await asyncio.wait_for(self._responses_for(chat_id).get(), timeout)
+
+    def drain_responses(self, chat_id: int) -> list[tuple[float, str, dict]]:
+        responses = self._responses_for(chat_id)
+        drained = []
+        while not responses.empty():
+            drained.append(responses.get_nowait())
+        return drained
+
+    # Bot API
+
+    async def _call(self, method: str, params: dict):
+        if method == "getMe":
+            return BOT_USER
+        if method == "getUpdates":
+            return await self._get_updates(params)
+        if self.api_delay:
+            await asyncio.sleep(self.api_delay)
+        if method == "setWebhook":
+            self.webhook_url = params.get("url")
+            self.webhook_secret = params.get("secret_token")
+            return True
+        if method == "deleteWebhook":
+            self.webhook_url = None
+            return True
+        if method == "getWebhookInfo":
+            return {"url": self.webhook_url or "", "has_custom_certificate": False, "pending_update_count": 0}
+
+        if method in RESPONSE_METHODS:
+            chat_id = params.get("chat_id") or self._callback_users.get(str(params.get("callback_query_id")))
+            if chat_id is not None:
+                self._responses_for(int(chat_id)).put_nowait((time.perf_counter(), method, params))
+
+        if method in MESSAGE_METHODS:
+            chat_id = int(params.get("chat_id") or 0)
+            return {
+                "message_id": int(params.get("message_id") or next(self._message_ids)),
+                "date": int(time.time()),
+                "chat": self._chat(chat_id),
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            }
+        return True
+
+    async def _get_updates(self, params: dict) -> list:
+        offset = int(params.get("offset") or 0)
+        self.updates = [update for update in self.updates if update["update_id"] >= offset]
+
+        if not self.updates:
+            self._new_update.clear()
+            try:
+                await asyncio.wait_for(self._new_update.wait(), float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                pass
+
+        limit = int(params.get("limit") or 100)
+        return self.updates[:limit]
+
+    # HTTP
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    return
+                _, target, _ = request_line.decode().split(" ", 2)
+
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, value = line.decode().split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                method = urlsplit(target).path.rsplit("/", 1)[-1]
+                params = self._parse_params(headers.get("content-type", ""), body)
+
+                self.calls.append((time.perf_counter(), method, params))
+                result = await self._call(method, params)
+
+                payload = json.dumps({"ok": True, "result": result}).encode()
+                writer.write(b"HTTP/1.1 200 OK\r\n"
+                             b"Content-Type: application/json\r\n"
+                             b"Content-Length: " + str(len(payload)).encode() + b"\r\n\r\n" + payload)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # Client went away or the server is shutting down in the middle of a long poll
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _parse_params(content_type: str, body: bytes) -> dict:
+        if not body:
+            return {}
+        if content_type.startswith("application/json"):
+            return json.loads(body)
+
+        # The bot sends form fields with JSON-encoded non-string values
+        params = {}
+        for name, value in parse_qsl(body.decode()):
+            try:
+                params[name] = json.loads(value)
+            except ValueError:
+                params[name] = value
+        return params
@@ -0,0 +1,69 @@
+import socket
+
+import bot
+
+from cache import registered_users
+from database import Database
+
+FAKE_TOKEN = "123456:FAKE-TOKEN"
+WEBHOOK_SECRET = "benchmark-secret"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def prepare_database(db_file: str, users: int, queues: int = 1, extra_users: list[int] = ()) -> list[int]:
+    """
+    Creates a database with registered users 1..users (plus extra_users, e.g. admins)
+    and open queues on a fresh file and points the bot at it, with throttling and deduplication off.
+    Returns the ids of the open queues.
+    """
+    bot.DB_NAME = db_file
+    bot.SCHEDULES_WATCH_INTERVAL = 0
+    bot.THROTTLE_ENABLED = False
+    bot.DEDUP_ENABLED = False
+
+    with Database(db_file) as db:
+        db.create_database()
+        db.execute_many("INSERT INTO Users (user_id, full_name) VALUES (?, ?)",
+                        [(user_id, f"User {user_id}") for user_id in [*range(1, users + 1), *extra_users]])
+        db.execute_many("INSERT INTO Schedules (subject, subgroup, defense_date) VALUES (?, '1', '2024-01-01')",
+                        [(f"Subject {i}",) for i in range(1, queues + 1)])
+        schedule_ids = [row[0] for row in db.fetch("SELECT id FROM Schedules ORDER BY id")]
+        db.open_active_queues(schedule_ids)
+        registered_users.load(db.get_all_user_ids())
+
+    return schedule_ids
+
+
+async def start_bot(base_url: str, mode: str = "polling"):
+    """Starts the real Application against a fake Bot API in 'polling' or 'webhook' mode"""
+    app = bot.build_application(token=FAKE_TOKEN, base_url=base_url)
+    allowed_updates = bot.get_allowed_updates(app)
+
+    await app.initialize()
+    await app.start()
+
+    if mode == "webhook":
+        port = free_port()
+        await app.updater.start_webhook(
+            listen="127.0.0.1",
+            port=port,
+            url_path="webhook",
+            webhook_url=f"http://127.0.0.1:{port}/webhook",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=allowed_updates
+        )
+    else:
+        await app.updater.start_polling(poll_interval=0, timeout=10, allowed_updates=allowed_updates)
+
+    return app
+
+
+async def stop_bot(app):
+    await app.updater.stop()
+    await app.stop()
+    await app.shutdown()
@@ -0,0 +1,254 @@
+"""
+Load test: many students running the real conversations at once, like right after the 03:00 announcement.
+
+Every student goes through /get_in_queue -> queue -> lab number -> position and then /leave_the_queue,
+an admin keeps removing people with /remove_user meanwhile. Everything runs against the local
+fake Bot API and a temporary database.
+
+    python -m benchmarks.load_test [--users 300] [--queues 12] [--concurrency 300] [--rounds 1] [--mode polling]
+                                   [--api-delay 0.05] [--update-concurrency N]
+
+Reports throughput, update -> answer latency of every step, double-booked positions
+(seen in the bot's answers and in the database) and database errors the students got.
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from collections import Counter
+
+import bot
+
+from benchmarks.fake_telegram import FakeTelegram
+from benchmarks.harness import prepare_database, start_bot, stop_bot
+from benchmarks.stats import format_latencies
+from config import admin_ids
+from database import Database
+
+ADMIN_ID = admin_ids[0]
+
+DB_ERROR = "Помилка бази даних"
+SUCCESS = "Успіх"
+TOO_LATE = "Хтось встиг"
+
+RESPONSE_TIMEOUT = 30
+
+
+class LoadTest:
+    def __init__(self, fake: FakeTelegram):
+        self.fake = fake
+
+        self.latencies = {}  # step -> [seconds]
+        self.outcomes = Counter()
+        self.updates = 0
+
+        self.claims = {}  # (schedule_id, position) -> (user_id, lab_number) of the last successful claim
+        self.double_booked = []
+
+    # Talking to the bot
+
+    async def step(self, name: str, chat_id: int, push) -> dict:
+        """
+        Pushes one update and waits for the bot's answer (a new or edited message).
+        Callback answers that only stop the button spinner are skipped, but they don't reset the clock.
+        """
+        self.fake.drain_responses(chat_id)
+        pushed_at = await push
+        self.updates += 1
+
+        while True:
+            try:
+                answered_at, method, params = await self.fake.wait_for_response(chat_id, RESPONSE_TIMEOUT)
+            except asyncio.TimeoutError:
+                self.outcomes["немає відповіді"] += 1
+                return {}
+            if method != "answerCallbackQuery" or params.get("show_alert"):
+                break
+
+        self.latencies.setdefault(name, []).append(answered_at - pushed_at)
+        if DB_ERROR in params.get("text", ""):
+            self.outcomes["помилка бази даних"] += 1
+        return params
+
+    async def message(self, name: str, chat_id: int, text: str) -> dict:
+        return await self.step(name, chat_id, self.fake.push_message(chat_id, text))
+
+    async def tap(self, name: str, chat_id: int, data: str) -> dict:
+        return await self.step(name, chat_id, self.fake.push_callback(chat_id, data))
+
+    @staticmethod
+    def buttons(params: dict, prefix: str) -> list[tuple[str, str]]:
+        """(text, callback_data) of the buttons in the answer whose data starts with prefix"""
+        keyboard = (params.get("reply_markup") or {}).get("inline_keyboard", [])
+        return [(button["text"], button["callback_data"])
+                for row in keyboard for button in row
+                if button.get("callback_data", "").startswith(prefix)]
+
+    # Bookkeeping of who holds which position
+
+    def claimed(self, schedule_id: int, position: int, user_id: int, lab_number: int):
+        key = (schedule_id, position)
+        if key in self.claims:
+            self.double_booked.append((schedule_id, position, self.claims[key][0], user_id))
+        self.claims[key] = (user_id, lab_number)
+
+    def released(self, schedule_id: int, user_id: int, lab_number: int):
+        # Released as soon as the leave/remove is sent: a claim that succeeds before the delete commits
+        # is still a double booking, so the only thing this hides is a bot that answers success wrongly
+        for key, holder in list(self.claims.items()):
+            if key[0] == schedule_id and holder == (user_id, lab_number):
+                del self.claims[key]
+
+    # Flows
+
+    async def join(self, user_id: int, lab_number: int):
+        params = await self.message("/get_in_queue", user_id, "/get_in_queue")
+        queues = self.buttons(params, "get_in_")
+        if not queues:
+            self.outcomes["немає активних черг"] += 1
+            return
+
+        _, queue_data = random.choice(queues)
+        schedule_id = int(queue_data.replace("get_in_", ""))
+        await self.tap("get_in_", user_id, queue_data)
+
+        params = await self.message("номер лаби", user_id, str(lab_number))
+        positions = self.buttons(params, "pos_")
+        if not positions:
+            self.outcomes["черга заповнена"] += 1
+            await self.tap("cancel_queue", user_id, "cancel_queue")
+            return
+
+        _, position_data = random.choice(positions)
+        position = int(position_data.replace("pos_", ""))
+        text = (await self.tap("pos_", user_id, position_data)).get("text", "")
+
+        if SUCCESS in text:
+            self.outcomes["записався"] += 1
+            self.claimed(schedule_id, position, user_id, lab_number)
+        elif TOO_LATE in text:
+            self.outcomes["місце вже зайняли"] += 1
+
+    async def leave(self, user_id: int):
+        params = await self.message("/leave_the_queue", user_id, "/leave_the_queue")
+        entries = self.buttons(params, "leave_")
+        if not entries:
+            return
+
+        _, leave_data = random.choice(entries)
+        _, schedule_id, lab_number = leave_data.split("_")
+        self.released(int(schedule_id), user_id, int(lab_number))
+
+        text = (await self.tap("leave_", user_id, leave_data)).get("text", "")
+        if "викреслено" in text:
+            self.outcomes["покинув чергу"] += 1
+
+    async def remove(self, schedule_ids: list[int]):
+        params = await self.message("/remove_user", ADMIN_ID, "/remove_user")
+        if not self.buttons(params, "rm_q_"):
+            return
+
+        schedule_id = random.choice(schedule_ids)
+        params = await self.tap("rm_q_", ADMIN_ID, f"rm_q_{schedule_id}")
+        entries = self.buttons(params, "rm_usr_")
+        if not entries:
+            return
+
+        _, remove_data = random.choice(entries)
+        _, _, user_id, lab_number = remove_data.split("_")
+        self.released(schedule_id, int(user_id), int(lab_number))
+
+        text = (await self.tap("rm_usr_", ADMIN_ID, remove_data)).get("text", "")
+        if "видалено" in text:
+            self.outcomes["видалено адміном"] += 1
+
+    async def student(self, user_id: int, rounds: int, semaphore: asyncio.Semaphore):
+        async with semaphore:
+            for lab_number in range(1, rounds + 1):
+                await self.join(user_id, lab_number)
+                await self.leave(user_id)
+
+    async def admin(self, schedule_ids: list[int], stop: asyncio.Event):
+        # /start sets the admin command menu
+        await self.message("/start", ADMIN_ID, "/start")
+        while not stop.is_set():
+            await self.remove(schedule_ids)
+
+
+def database_duplicates(db_file: str) -> int:
+    with Database(db_file) as db:
+        return len(db.fetch("""
+            SELECT schedule_id, position FROM Queues
+            GROUP BY schedule_id, position HAVING COUNT(*) > 1
+        """))
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as directory:
+        db_file = os.path.join(directory, "load.db")
+        schedule_ids = prepare_database(db_file, users=args.users, queues=args.queues, extra_users=[ADMIN_ID])
+
+        if args.update_concurrency:
+            bot.UPDATE_CONCURRENCY = args.update_concurrency
+
+        fake = FakeTelegram(api_delay=args.api_delay)
+        await fake.start()
+        app = await start_bot(fake.base_url, args.mode)
+
+        test = LoadTest(fake)
+        semaphore = asyncio.Semaphore(args.concurrency)
+        stop = asyncio.Event()
+
+        started = time.perf_counter()
+        try:
+            admin = asyncio.create_task(test.admin(schedule_ids, stop))
+            await asyncio.gather(*(test.student(user_id, args.rounds, semaphore)
+                                   for user_id in range(1, args.users + 1)))
+            stop.set()
+            await admin
+        finally:
+            elapsed = time.perf_counter() - started
+            await stop_bot(app)
+            await fake.stop()
+
+        print(f"Режим: {args.mode}, студентів: {args.users}, черг: {args.queues}, "
+              f"одночасно: {args.concurrency}, раундів: {args.rounds}, "
+              f"затримка API: {args.api_delay * 1000:.0f} мс, паралельних оновлень: {bot.UPDATE_CONCURRENCY}")
+        print(f"Оновлень: {test.updates} за {elapsed:.2f} с ({test.updates / elapsed:.1f} оновлень/с)")
+        print("\nЗатримка оновлення -> відповіді:")
+        all_latencies = []
+        for name, latencies in test.latencies.items():
+            all_latencies.extend(latencies)
+            print(f"  {name:>18}: {format_latencies(latencies)}")
+        print(f"  {'усі кроки':>18}: {format_latencies(all_latencies)}")
+
+        print("\nРезультати:")
+        for outcome, count in sorted(test.outcomes.items()):
+            print(f"  {outcome}: {count}")
+
+        print(f"\nПодвійні записи у відповідях бота: {len(test.double_booked)}")
+        for schedule_id, position, first, second in test.double_booked[:10]:
+            print(f"  черга {schedule_id}, позиція {position}: користувачі {first} і {second}")
+        print(f"Подвійні записи в базі: {database_duplicates(db_file)}")
+        print(f"Помилки бази даних у відповідях: {test.outcomes['помилка бази даних']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--queues", type=int, default=12)
+    parser.add_argument("--concurrency", type=int, default=300, help="students running their flows at once")
+    parser.add_argument("--rounds", type=int, default=1, help="join + leave cycles per student")
+    parser.add_argument("--mode", choices=("polling", "webhook"), default="polling")
+    parser.add_argument("--api-delay", type=float, default=0.05, help="simulated Bot API round-trip, seconds")
+    parser.add_argument("--update-concurrency", type=int, help="overrides UPDATE_CONCURRENCY, 1 = sequential")
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+def percentile(values: list[float], p: float) -> float:
+    """p-th percentile (0-100) using nearest rank"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def format_latencies(values: list[float]) -> str:
+    """Seconds -> 'p50 ... p95 ... p99 ... max ...' in milliseconds"""
+    if not values:
+        return "немає даних"
+    return (f"p50 {percentile(values, 50) * 1000:.2f} мс, "
+            f"p95 {percentile(values, 95) * 1000:.2f} мс, "
+            f"p99 {percentile(values, 99) * 1000:.2f} мс, "
+            f"max {max(values) * 1000:.2f} мс")
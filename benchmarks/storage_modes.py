@@ -0,0 +1,90 @@
+"""
+Compares write and read latency of the storage modes:
+rollback journal with a commit per statement, WAL with a commit per statement
+and WAL with the group-commit writer, so the journal mode and the writer can be judged separately.
+
+    python -m benchmarks.storage_modes [--threads 16] [--operations 200]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+import database
+
+from benchmarks.stats import format_latencies
+from database import Database
+
+MODES = {
+    "rollback journal, commit per statement": dict(journal_mode="DELETE", synchronous="FULL", group_commit=False),
+    "WAL, commit per statement": dict(journal_mode="WAL", synchronous="NORMAL", group_commit=False),
+    "WAL + group commit": dict(journal_mode="WAL", synchronous="NORMAL", group_commit=True),
+}
+
+
+def prepare(db_file: str, users: int, positions: int):
+    with Database(db_file) as db:
+        db.create_database()
+        db.execute_many("INSERT INTO Users (user_id, full_name) VALUES (?, ?)",
+                        [(user_id, f"User {user_id}") for user_id in range(1, users + 1)])
+        db.execute("INSERT INTO Schedules (subject, subgroup, defense_date) VALUES ('Bench', '1', '2024-01-01')")
+        db.open_active_queues([1])
+        db.set_queue_capacity(1, positions)
+
+
+def worker(db_file: str, thread_index: int, operations: int, write_latencies: list, read_latencies: list):
+    user_id = thread_index + 1
+    for i in range(operations):
+        started = time.perf_counter()
+        with Database(db_file) as db:
+            # Positions are unique per thread, so every claim succeeds
+            db.add_user_to_queue(1, user_id, i, thread_index * operations + i + 1)
+            db.remove_user_from_queue(1, user_id, i)
+        write_latencies.append((time.perf_counter() - started) / 2)
+
+        started = time.perf_counter()
+        with Database(db_file) as db:
+            db.get_current_active_queues()
+            db.get_taken_positions(1)
+        read_latencies.append((time.perf_counter() - started) / 2)
+
+
+def run_mode(name: str, settings: dict, threads: int, operations: int):
+    with tempfile.TemporaryDirectory() as directory:
+        db_file = os.path.join(directory, "bench.db")
+        pool = database.configure_pool(db_file, max_size=threads, **settings)
+        prepare(db_file, threads, threads * operations)
+
+        write_latencies, read_latencies = [], []
+        workers = [threading.Thread(target=worker, args=(db_file, i, operations, write_latencies, read_latencies))
+                   for i in range(threads)]
+
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        pool.close_all()
+
+    total_writes = len(write_latencies) * 2
+    print(f"== {name}")
+    print(f"   записів: {total_writes} за {elapsed:.2f} с ({total_writes / elapsed:.0f}/с)")
+    print(f"   запис:   {format_latencies(write_latencies)}")
+    print(f"   читання: {format_latencies(read_latencies)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--operations", type=int, default=200, help="join/leave pairs per thread")
+    args = parser.parse_args()
+
+    for name, settings in MODES.items():
+        run_mode(name, settings, args.threads, args.operations)
+
+
+if __name__ == "__main__":
+    main()
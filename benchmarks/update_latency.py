@@ -0,0 +1,55 @@
+"""
+End-to-end update latency (update pushed -> first answer from the bot) for long polling vs webhook,
+measured against the local fake Bot API, so no network connection is needed.
+
+    python -m benchmarks.update_latency [--updates 200]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+
+from benchmarks.fake_telegram import FakeTelegram
+from benchmarks.harness import prepare_database, start_bot, stop_bot
+from benchmarks.stats import format_latencies
+
+USER_ID = 1
+
+
+async def measure(mode: str, updates: int) -> list[float]:
+    fake = FakeTelegram()
+    await fake.start()
+    app = await start_bot(fake.base_url, mode)
+
+    latencies = []
+    try:
+        for _ in range(updates):
+            pushed_at = await fake.push_message(USER_ID, "/show_table")
+            answered_at, _, _ = await fake.wait_for_response(USER_ID)
+            latencies.append(answered_at - pushed_at)
+    finally:
+        await stop_bot(app)
+        await fake.stop()
+
+    return latencies
+
+
+async def run(updates: int):
+    with tempfile.TemporaryDirectory() as directory:
+        prepare_database(os.path.join(directory, "bench.db"), users=1)
+
+        for mode in ("polling", "webhook"):
+            latencies = await measure(mode, updates)
+            print(f"{mode:>8}: {format_latencies(latencies)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=200)
+    args = parser.parse_args()
+
+    asyncio.run(run(args.updates))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,35 @@
 from telegram import Update, BotCommand, BotCommandScopeDefault, BotCommandScopeChat, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, ConversationHandler, CallbackQueryHandler
+from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, ConversationHandler, CallbackQueryHandler, TypeHandler, ApplicationHandlerStop
 from telegram.ext.filters import MessageFilter
+from telegram.error import BadRequest
+
+import asyncio
+import os
 
 from datetime import datetime, timedelta, time
 
 from config import *
-from database import Database
+from database import Database, add_query_hook
+from async_database import AsyncDatabase
 from exception import DatabaseException
+from outbox import OutboxWorker, enqueue
+from cache import registered_users, queue_tables, taken_positions, active_queues
+from schedule_parser import file_hash
+from query_stats import query_stats
+from metrics import instrument, MetricsServer, measure_event_loop_lag, updates_received
+from update_processor import PerUserUpdateProcessor
+from persistence import SQLitePersistence
+from throttle import Throttle
+from dedup import RecentCallbacks
+from state_sweeper import StateSweeper, deep_sizeof, state_entries, state_bytes, state_evicted
+
+
+outbox_worker = OutboxWorker()
+metrics_server = MetricsServer(METRICS_HOST, METRICS_PORT)
+background_tasks = set()
+recent_callbacks = RecentCallbacks(DEDUP_PREFIXES, DEDUP_WINDOW)
+throttle = Throttle(THROTTLE_RULES, THROTTLE_GLOBAL_RATE, THROTTLE_GLOBAL_BURST)
+state_sweeper = StateSweeper(USER_DATA_TTL, USER_DATA_MAX_USERS, min_idle=CONVERSATION_TIMEOUT)
 
 
 class IsRegisteredUserFilter(MessageFilter):
@@ -17,6 +40,9 @@ class IsRegisteredUserFilter(MessageFilter):
             
         user_id = message.from_user.id
 
+        if registered_users.loaded:
+            return registered_users.contains(user_id)
+
         try:
             with Database(DB_NAME) as db:
                 return db.is_user_registered(user_id)
@@ -46,8 +72,11 @@ ADMIN_COMMANDS = USER_COMMANDS + [
     BotCommand("remove_user", "Видалити юзера з черги"),
     BotCommand("new_queue", "Нова черга"),
     BotCommand("reschedule", "Переназначити чергу"),
+    BotCommand("set_capacity", "Змінити кількість місць у черзі"),
     BotCommand("broadcast", "Розіслати повідомлення"),
-    BotCommand("toggle_registration", "Увімкнути/вимкнути реєстрацію")
+    BotCommand("toggle_registration", "Увімкнути/вимкнути реєстрацію"),
+    BotCommand("reload_schedules", "Перечитати розклад"),
+    BotCommand("db_stats", "Статистика запитів до бази")
 ]
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -60,22 +89,26 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
 
     try:
-        with Database(DB_NAME) as db:
-            # Check if registration is enabled
-            is_registration_open = db.is_registration_enabled()
-            if not is_registration_open:
-                await update.message.reply_text("Наразі реєстрація нових користувачів закрита.")
-                return ConversationHandler.END
-
-            # Check if user is not already registred
-            is_registered = db.is_user_registered(user_id)
-            if is_registered:
-                await update.message.reply_text("Ти вже зареєстрований! Обирай що робимо далі!")
-                return ConversationHandler.END
+        db = AsyncDatabase(DB_NAME)
+        is_registration_open = await db.is_registration_enabled()
+        is_registered = await db.is_user_registered(user_id)
+        if is_registered:
+            # The user is talking to the bot again, so broadcasts can reach them
+            await db.unblock_user(user_id)
     except DatabaseException:
         await update.message.reply_text("Помилка реєстрації.")
         return ConversationHandler.END
 
+    # Check if registration is enabled
+    if not is_registration_open:
+        await update.message.reply_text("Наразі реєстрація нових користувачів закрита.")
+        return ConversationHandler.END
+
+    # Check if user is not already registred
+    if is_registered:
+        await update.message.reply_text("Ти вже зареєстрований! Обирай що робимо далі!")
+        return ConversationHandler.END
+
     if user_id in context.bot_data:
         await update.message.reply_text("Твоя заявка вже розглядається адміністратором. Будь ласка, зачекай.")
         return ConversationHandler.END
@@ -93,7 +126,7 @@ async def receive_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         user_link = f"без юзернейму"
 
-    context.bot_data[user_id] = {"name": full_name}
+    context.bot_data[user_id] = {"name": full_name, "requested_at": datetime.now().timestamp()}
 
     keyboard = [
         [
@@ -104,15 +137,12 @@ async def receive_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     # Admin registration handling keyboard
-    for admin_id in admin_ids:
-        try:
-            await context.bot.send_message(
-                chat_id=admin_id, 
-                text=f"Нова заявка на реєстрацію!\nІм'я: {full_name}\nUsername: {user_link}",
-                reply_markup=reply_markup
-            )
-        except Exception:
-            pass
+    text = f"Нова заявка на реєстрацію!\nІм'я: {full_name}\nUsername: {user_link}"
+    try:
+        await enqueue(DB_NAME, [(admin_id, text, reply_markup) for admin_id in admin_ids])
+        kick_outbox(context)
+    except DatabaseException as e:
+        print(f"❌ Помилка постановки сповіщень адмінам у чергу: {e}")
 
     # Response for user
     await update.message.reply_text("Твої дані відправлено на перевірку адміністратору. Очікуй!")
@@ -137,63 +167,140 @@ async def admin_registration_decision(update: Update, context: ContextTypes.DEFA
     action, user_id_str = query.data.split('_')
     target_user_id = int(user_id_str)
 
-    if target_user_id not in context.bot_data:
+    # Taken before the first await: admins are processed concurrently and only one may decide
+    user_info = context.bot_data.pop(target_user_id, None)
+    if user_info is None:
         await query.edit_message_text("ℹ️ Цю заявку вже було оброблено іншим адміністратором.", reply_markup=None)
         return
 
     if action == "approve":
-        user_info = context.bot_data.get(target_user_id)
-        full_name = user_info["name"] if user_info else "Невідомий"
+        full_name = user_info["name"]
         try:
-            with Database(DB_NAME) as db:
-                db.register_user(target_user_id, full_name)
+            await AsyncDatabase(DB_NAME).register_user(target_user_id, full_name)
         except DatabaseException:
+            # Give the request back, so it can be approved again
+            context.bot_data[target_user_id] = user_info
+            forget_tap(query)
             await query.edit_message_text("❌ Помилка бази даних при додаванні користувача.", reply_markup=None)
             return
 
         await context.bot.set_my_commands(USER_COMMANDS, scope=BotCommandScopeChat(chat_id=target_user_id))
         
-        await context.bot.send_message(chat_id=target_user_id, text="Твою заявку схвалено! Меню оновлено, можеш користуватися ботом.")
+        await notify(context, target_user_id, "Твою заявку схвалено! Меню оновлено, можеш користуватися ботом.")
         await query.edit_message_text(f"✅ Користувача {target_user_id} прийнято.", reply_markup=None)
         
     elif action == "reject":
-        await context.bot.send_message(chat_id=target_user_id, text="На жаль, твою заявку було відхилено.")
+        await notify(context, target_user_id, "На жаль, твою заявку було відхилено.")
         await query.edit_message_text(f"❌ Користувача {target_user_id} відхилено.", reply_markup=None)
-
-    if target_user_id in context.bot_data:
-        del context.bot_data[target_user_id]
             
         
+def format_queue_table(subject: str, subgroup: str, queue: list[tuple]) -> str:
+    lines = [f"📋 {subject} (Підгрупа: {subgroup})", ""]
+
+    if not queue:
+        lines.append("Черга поки порожня.")
+
+    for position, full_name, lab_number in queue:
+        lines.append(f"{position}. {full_name} — лаба №{lab_number}")
+
+    return "\n".join(lines)
+
+# Menus of the open queues: kind -> (button text, callback data prefix, cancel callback data or None)
+ACTIVE_QUEUE_MENUS = {
+    "show": ("{subject} (Підгрупа: {subgroup}) - {date}", "show_t_", None),
+    "get_in": ("{subject} (Підгрупа: {subgroup}) - {date}", "get_in_", "cancel_queue"),
+    "close": ("{subject} ({subgroup}) - {date}", "close_q_", "cancel_close"),
+    "remove": ("{subject} ({subgroup}) - {date}", "rm_q_", "cancel_rm"),
+}
+
+async def active_queues_menu(kind: str) -> InlineKeyboardMarkup | None:
+    """
+    Buttons of the open queues for one of ACTIVE_QUEUE_MENUS, None if no queue is open.
+    Queues and menus are cached until Database changes them, so this is normally served from memory.
+    """
+    menu = active_queues.get_menu(kind)
+    if menu is not None:
+        return menu
+
+    version = active_queues.version()
+    queues = active_queues.get()
+    if queues is None:
+        queues = await AsyncDatabase(DB_NAME).get_current_active_queues()
+        active_queues.put(version, queues)
+
+    if not queues:
+        return None
+
+    text, prefix, cancel_data = ACTIVE_QUEUE_MENUS[kind]
+    keyboard = []
+    for schedule_id, subject, subgroup, date in queues:
+        btn_text = text.format(subject=subject, subgroup=subgroup, date=date)
+        keyboard.append([InlineKeyboardButton(btn_text, callback_data=f"{prefix}{schedule_id}")])
+    if cancel_data:
+        keyboard.append([InlineKeyboardButton("🔙 Скасувати", callback_data=cancel_data)])
+
+    menu = InlineKeyboardMarkup(keyboard)
+    active_queues.put_menu(kind, version, menu)
+    return menu
+
 async def show_table(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    pass
+    try:
+        reply_markup = await active_queues_menu("show")
+    except DatabaseException:
+        await update.message.reply_text("❌ Помилка бази даних.")
+        return
+
+    if not reply_markup:
+        await update.message.reply_text("Зараз немає активних черг.")
+        return
+
+    await update.message.reply_text(
+        "Обери чергу, яку хочеш переглянути:",
+        reply_markup=reply_markup
+    )
+
+async def queue_to_show_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    schedule_id = int(query.data.replace("show_t_", ""))
+
+    # Rendered tables are reused until the queue changes
+    text = queue_tables.get(schedule_id)
+    if text is None:
+        version = queue_tables.version(schedule_id)
+        try:
+            db = AsyncDatabase(DB_NAME)
+            schedule = await db.get_subject_name_and_subgroup(schedule_id)
+            queue = await db.get_queue_for_schedule(schedule_id) if schedule else None
+        except DatabaseException:
+            await query.edit_message_text("❌ Помилка бази даних.")
+            return
+
+        if schedule is None:
+            # Deleted by a schedules reload after the menu was sent
+            await query.edit_message_text("Цієї черги більше не існує.")
+            return
+        subject, subgroup = schedule
+
+        text = format_queue_table(subject, subgroup, queue)
+        queue_tables.put(schedule_id, version, text)
+
+    await query.edit_message_text(text)
 
 async def get_in_queue(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
 
-    active_queues = []
     try:
-        with Database(DB_NAME) as db:
-            active_queues = db.get_current_active_queues()
+        reply_markup = await active_queues_menu("get_in")
     except DatabaseException:
         await update.message.reply_text("❌ Помилка бази даних.")
         return ConversationHandler.END
 
-    if not active_queues:
+    if not reply_markup:
         await update.message.reply_text("Зараз немає активних черг.")
         return ConversationHandler.END
 
-    keyboard = []
-
-    for aq in active_queues:
-        # aq[0]=id, aq[1]=subject, aq[2]=subgroup, aq[3]=date
-        btn_text = f"{aq[1]} (Підгрупа: {aq[2]}) - {aq[3]}"
-        btn_data = f"get_in_{aq[0]}"
-        
-        keyboard.append([InlineKeyboardButton(btn_text, callback_data=btn_data)])
-
-    keyboard.append([InlineKeyboardButton("🔙 Скасувати", callback_data="cancel_queue")])
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
     await context.bot.send_message(
         chat_id=user_id, 
         text=f"Доступні для запису черги:",
@@ -230,41 +337,92 @@ async def receive_lab_number(update: Update, context: ContextTypes.DEFAULT_TYPE)
     schedule_id = context.user_data.get('selected_schedule_id')
 
     try:
-        with Database(DB_NAME) as db:
-            if db.is_same_user_in_queue(user_id, schedule_id, lab_number):
-                await update.message.reply_text(f"⚠️ Ти вже стоїш у цій черзі з лабою №{lab_number}!")
-                del context.user_data['selected_schedule_id']
-                return ConversationHandler.END
-            
-            taken_positions = db.get_taken_positions(schedule_id)
-            
+        is_same_user_in_queue = await AsyncDatabase(DB_NAME).is_same_user_in_queue(user_id, schedule_id, lab_number)
+        if not is_same_user_in_queue:
+            capacity, taken = await load_queue_slots(schedule_id)
     except DatabaseException:
         await update.message.reply_text("❌ Помилка бази даних.")
         return ConversationHandler.END
 
+    if is_same_user_in_queue:
+        await update.message.reply_text(f"⚠️ Ти вже стоїш у цій черзі з лабою №{lab_number}!")
+        del context.user_data['selected_schedule_id']
+        return ConversationHandler.END
+
+    if not capacity:
+        await update.message.reply_text("Цієї черги більше не існує.")
+        context.user_data.clear()
+        return ConversationHandler.END
+
     context.user_data['lab_number'] = lab_number
 
-    MAX_POSITIONS = 25
+    await update.message.reply_text(
+        "Обери вільне місце в черзі:", 
+        reply_markup=build_position_keyboard(capacity, taken, 0)
+    )
+    return SELECTING_POSITION
+
+async def load_queue_slots(schedule_id: int) -> tuple[int, int]:
+    """(capacity, bitmap of taken positions) from the cache, read from the database on a miss"""
+    slots = taken_positions.get(schedule_id)
+    if slots is None:
+        version = taken_positions.version(schedule_id)
+        capacity, positions = await AsyncDatabase(DB_NAME).get_queue_slots(schedule_id)
+        slots = taken_positions.put(schedule_id, version, capacity, positions)
+    return slots
+
+def build_position_keyboard(capacity: int, taken: int, page: int) -> InlineKeyboardMarkup:
+    """One page of the position picker; only the positions on the page are checked in the bitmap"""
+    pages = max(1, -(-capacity // POSITIONS_PER_PAGE))
+    page = min(max(page, 0), pages - 1)
+    first = page * POSITIONS_PER_PAGE + 1
+    last = min(first + POSITIONS_PER_PAGE - 1, capacity)
+
     keyboard = []
     row = []
-    
-    for i in range(1, MAX_POSITIONS + 1):
-        if i in taken_positions:
+
+    for i in range(first, last + 1):
+        if taken >> i & 1:
             row.append(InlineKeyboardButton("❌", callback_data="taken_pos"))
         else:
             row.append(InlineKeyboardButton(str(i), callback_data=f"pos_{i}"))
-            
-        if len(row) == 5:
+
+        if len(row) == POSITIONS_PER_ROW:
             keyboard.append(row)
             row = []
 
+    if row:
+        keyboard.append(row)
+
+    if pages > 1:
+        keyboard.append([
+            InlineKeyboardButton("◀️", callback_data=f"pospage_{(page - 1) % pages}"),
+            InlineKeyboardButton(f"{page + 1}/{pages}", callback_data=f"pospage_{page}"),
+            InlineKeyboardButton("▶️", callback_data=f"pospage_{(page + 1) % pages}")
+        ])
+
     keyboard.append([InlineKeyboardButton("🔙 Скасувати", callback_data="cancel_queue")])
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    return InlineKeyboardMarkup(keyboard)
 
-    await update.message.reply_text(
-        "Обери вільне місце в черзі:", 
-        reply_markup=reply_markup
-    )
+async def position_page_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    page = int(query.data.replace("pospage_", ""))
+    schedule_id = context.user_data.get('selected_schedule_id')
+
+    try:
+        capacity, taken = await load_queue_slots(schedule_id)
+    except DatabaseException:
+        await query.edit_message_text("❌ Помилка бази даних.")
+        context.user_data.clear()
+        return ConversationHandler.END
+
+    try:
+        await query.edit_message_reply_markup(build_position_keyboard(capacity, taken, page))
+    except BadRequest:
+        # The page hasn't changed since it was shown
+        pass
     return SELECTING_POSITION
 
 
@@ -281,8 +439,6 @@ async def position_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.user_data.clear()
         return ConversationHandler.END
 
-    await query.answer()
-
     position = int(query.data.replace("pos_", ""))
     
     schedule_id = context.user_data.get('selected_schedule_id')
@@ -290,21 +446,36 @@ async def position_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
 
     try:
-        with Database(DB_NAME) as db:
-            if db.is_position_taken(schedule_id, position):
-                await query.edit_message_text("Ой! Хтось встиг зайняти це місце швидше за тебе. Спробуй /get_in_queue ще раз.")
-                context.user_data.clear()
-                return ConversationHandler.END
+        capacity, taken = await load_queue_slots(schedule_id)
+    except DatabaseException:
+        await query.answer()
+        forget_tap(query)
+        await query.edit_message_text("❌ Помилка бази даних при записі.")
+        context.user_data.clear()
+        return ConversationHandler.END
 
-            db.add_user_to_queue(schedule_id, user_id, lab_number, position)
-            
+    if not 1 <= position <= capacity:
+        # The queue was shortened by /set_capacity after the keyboard was shown
+        await query.answer("Цього місця в черзі більше немає! Обери інше.", show_alert=True)
+        await query.edit_message_reply_markup(build_position_keyboard(capacity, taken, 0))
+        return SELECTING_POSITION
+
+    await query.answer()
+
+    try:
+        is_added = await AsyncDatabase(DB_NAME).add_user_to_queue(schedule_id, user_id, lab_number, position)
     except DatabaseException:
+        forget_tap(query)
         await query.edit_message_text("❌ Помилка бази даних при записі.")
         context.user_data.clear()
         return ConversationHandler.END
 
     context.user_data.clear()
 
+    if not is_added:
+        await query.edit_message_text("Ой! Хтось встиг зайняти це місце швидше за тебе. Спробуй /get_in_queue ще раз.")
+        return ConversationHandler.END
+
     await query.edit_message_text(f"✅ Успіх! Тебе записано в чергу.\nТвоя позиція: **{position}**", parse_mode="Markdown")
     return ConversationHandler.END
 
@@ -318,8 +489,7 @@ async def leave_the_queue(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     
     try:
-        with Database(DB_NAME) as db:
-            user_queues = db.get_user_queues(user_id)
+        user_queues = await AsyncDatabase(DB_NAME).get_user_queues(user_id)
     except DatabaseException:
         await update.message.reply_text("❌ Помилка бази даних.")
         return ConversationHandler.END
@@ -358,9 +528,9 @@ async def queue_for_leaving_selected(update: Update, context: ContextTypes.DEFAU
     user_id = update.effective_user.id
 
     try:
-        with Database(DB_NAME) as db:
-            db.remove_user_from_queue(schedule_id, user_id, lab_number)
+        await AsyncDatabase(DB_NAME).remove_user_from_queue(schedule_id, user_id, lab_number)
     except DatabaseException:
+        forget_tap(query)
         await query.edit_message_text("❌ Помилка бази даних. Вас не видалено з черги. Спробуйте ще.")
         return ConversationHandler.END
     
@@ -378,24 +548,15 @@ async def cancel_leave(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def close_queue(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
-        with Database(DB_NAME) as db:
-            active_queues = db.get_current_active_queues()
+        reply_markup = await active_queues_menu("close")
     except DatabaseException:
         await update.message.reply_text("❌ Помилка бази даних.")
         return ConversationHandler.END
 
-    if not active_queues:
+    if not reply_markup:
         await update.message.reply_text("Зараз немає активних черг.")
         return ConversationHandler.END
 
-    keyboard = []
-    for aq in active_queues:
-        btn_text = f"{aq[1]} ({aq[2]}) - {aq[3]}"
-        btn_data = f"close_q_{aq[0]}"
-        keyboard.append([InlineKeyboardButton(btn_text, callback_data=btn_data)])
-
-    keyboard.append([InlineKeyboardButton("🔙 Скасувати", callback_data="cancel_close")])
-    reply_markup = InlineKeyboardMarkup(keyboard)
     await update.message.reply_text(
         "Обери чергу, яку хочеш закрити:",
         reply_markup=reply_markup
@@ -409,8 +570,7 @@ async def queue_to_close_selected(update: Update, context: ContextTypes.DEFAULT_
     schedule_id = int(query.data.replace("close_q_", ""))
 
     try:
-        with Database(DB_NAME) as db:
-            db.close_active_queue(schedule_id)
+        await AsyncDatabase(DB_NAME).close_active_queue(schedule_id)
     except DatabaseException:
         await query.edit_message_text("❌ Помилка бази даних.")
         return ConversationHandler.END
@@ -429,25 +589,15 @@ async def cancel_close(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def remove_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
-        with Database(DB_NAME) as db:
-            active_queues = db.get_current_active_queues()
+        reply_markup = await active_queues_menu("remove")
     except DatabaseException:
         await update.message.reply_text("❌ Помилка бази даних.")
         return ConversationHandler.END
 
-    if not active_queues:
+    if not reply_markup:
         await update.message.reply_text("Зараз немає активних черг.")
         return ConversationHandler.END
 
-    keyboard = []
-    for aq in active_queues:
-        btn_text = f"{aq[1]} ({aq[2]}) - {aq[3]}"
-        btn_data = f"rm_q_{aq[0]}"
-        keyboard.append([InlineKeyboardButton(btn_text, callback_data=btn_data)])
-
-    keyboard.append([InlineKeyboardButton("🔙 Скасувати", callback_data="cancel_rm")])
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
     await update.message.reply_text(
         "Обери чергу, з якої хочеш видалити юзера:",
         reply_markup=reply_markup
@@ -463,8 +613,7 @@ async def queue_to_remove_from_selected(update: Update, context: ContextTypes.DE
     context.user_data['rm_schedule_id'] = schedule_id
 
     try:
-        with Database(DB_NAME) as db:
-            users_in_queue = db.get_queue_with_users(schedule_id)
+        users_in_queue = await AsyncDatabase(DB_NAME).get_queue_with_users(schedule_id)
     except DatabaseException:
         await query.edit_message_text("❌ Помилка бази даних.")
         return ConversationHandler.END
@@ -500,9 +649,9 @@ async def user_to_remove_selected(update: Update, context: ContextTypes.DEFAULT_
     schedule_id = context.user_data.get('rm_schedule_id')
 
     try:
-        with Database(DB_NAME) as db:
-            db.remove_user_from_queue(schedule_id, user_id, lab_number)
+        await AsyncDatabase(DB_NAME).remove_user_from_queue(schedule_id, user_id, lab_number)
     except DatabaseException:
+        forget_tap(query)
         await query.edit_message_text("❌ Помилка бази даних.")
         context.user_data.clear()
         return ConversationHandler.END
@@ -544,8 +693,7 @@ async def new_queue(update: Update, context: ContextTypes.DEFAULT_TYPE):
     subject, subgroup, defense_date = parts
 
     try:
-        with Database(DB_NAME) as db:
-            db.insert_defense_dates(subject, subgroup, defense_date)
+        await AsyncDatabase(DB_NAME).insert_defense_dates(subject, subgroup, defense_date)
 
         await update.message.reply_text(
             f"Новий розклад успішно створено!\n\n"
@@ -581,8 +729,7 @@ async def reschedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
     schedule_id = int(schedule_id_str)
 
     try:
-        with Database(DB_NAME) as db:
-            db.reschedule_queue(schedule_id, new_date)
+        await AsyncDatabase(DB_NAME).reschedule_queue(schedule_id, new_date)
 
         await update.message.reply_text(
             f"✅ Дату для розкладу #{schedule_id} успішно змінено на {new_date}."
@@ -595,6 +742,34 @@ async def reschedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except DatabaseException as e:
         await update.message.reply_text(f"❌ Помилка бази даних: {e.message}")
 
+async def set_capacity(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if len(context.args) != 2 or not all(arg.isdigit() for arg in context.args):
+        await update.message.reply_text(
+            "❌ Неправильний формат.\n\n"
+            "*Використання:* `/set_capacity <ID_розкладу> <Кількість_місць>`\n"
+            "*Приклад:* `/set_capacity 3 100`",
+            parse_mode="Markdown"
+        )
+        return
+
+    schedule_id, capacity = map(int, context.args)
+
+    if not 1 <= capacity <= MAX_QUEUE_CAPACITY:
+        await update.message.reply_text(f"❌ Кількість місць має бути від 1 до {MAX_QUEUE_CAPACITY}.")
+        return
+
+    try:
+        is_updated = await AsyncDatabase(DB_NAME).set_queue_capacity(schedule_id, capacity)
+    except DatabaseException as e:
+        await update.message.reply_text(f"❌ Помилка бази даних: {e.message}")
+        return
+
+    if not is_updated:
+        await update.message.reply_text(f"❌ Розкладу #{schedule_id} не знайдено.")
+        return
+
+    await update.message.reply_text(f"✅ У черзі для розкладу #{schedule_id} тепер {capacity} місць.")
+
 async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not context.args:
         await update.message.reply_text(
@@ -604,12 +779,8 @@ async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     text = " ".join(context.args)
 
-    success_count = 0
-    error_count = 0
-
     try:
-        with Database(DB_NAME) as db:
-            user_ids = db.get_user_ids()
+        user_ids = await AsyncDatabase(DB_NAME).get_user_ids()
     except DatabaseException:
         await update.message.reply_text("Помилка з отриманням ID користувачів.")
         return
@@ -618,48 +789,138 @@ async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("У базі немає користувачів для розсилки.")
         return
 
-    for user_id in user_ids:
-        try:
-            await context.bot.send_message(chat_id=user_id, text=text)
-            success_count += 1
-        except Exception as e:
-            print(f"Помилка відправки користувачу {user_id}: {e}")
-            error_count += 1
+    # The outbox worker edits this message while it delivers the batch
+    progress_message = await update.message.reply_text(f"📢 Розсилка: 0/{len(user_ids)}")
 
-    await update.message.reply_text(
-        f"📢 Розсилку завершено!\n\n"
-        f"✅ Успішно надіслано: {success_count}\n"
-        f"❌ Помилок (заблокували бота тощо): {error_count}")
+    try:
+        await enqueue(DB_NAME, [(user_id, text) for user_id in user_ids], progress_message=progress_message)
+    except DatabaseException:
+        await progress_message.edit_text("❌ Помилка бази даних. Розсилку не розпочато.")
+        return
+
+    kick_outbox(context)
 
 async def toggle_registration(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = ""
     try:
-        with Database(DB_NAME) as db:
-            result = db.toggle_registration()
-            match result:
-                case 0:
-                    text = "Реєстрацію вимкнено!"
-                case 1:
-                    text = "Реєстрацію увімкнено!"
+        result = await AsyncDatabase(DB_NAME).toggle_registration()
+        match result:
+            case 0:
+                text = "Реєстрацію вимкнено!"
+            case 1:
+                text = "Реєстрацію увімкнено!"
 
     except DatabaseException as e:
         text = "Помилка з базою даних"
 
     await update.message.reply_text(text)
 
+async def reload_schedules(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        added, removed, moved = await AsyncDatabase(DB_NAME).sync_schedules(SCHEDULES_FILE)
+    except (OSError, ValueError) as e:
+        await update.message.reply_text(f"❌ Не вдалося прочитати {SCHEDULES_FILE}: {e}")
+        return
+    except DatabaseException as e:
+        await update.message.reply_text(f"❌ Помилка бази даних: {e.message}")
+        return
+
+    await update.message.reply_text(
+        f"✅ Розклад оновлено!\n\n"
+        f"Додано: {added}\n"
+        f"Видалено: {removed}\n"
+        f"Перенесено: {moved}"
+    )
+
+async def db_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/db_stats shows the most expensive queries, /db_stats reset starts counting anew"""
+    if not DB_QUERY_STATS:
+        await update.message.reply_text("Статистику запитів вимкнено (DB_QUERY_STATS).")
+        return
+
+    if context.args and context.args[0] == "reset":
+        query_stats.reset()
+        await update.message.reply_text("✅ Статистику запитів скинуто.")
+        return
+
+    await update.message.reply_text(query_stats.format_snapshot())
+
+async def watch_schedules_job(context: ContextTypes.DEFAULT_TYPE):
+    """Applies schedules file changes without a restart"""
+    state = context.job.data
+
+    try:
+        mtime = os.stat(SCHEDULES_FILE).st_mtime
+        if mtime == state.get("mtime"):
+            return
+
+        content_hash = file_hash(SCHEDULES_FILE)
+        if content_hash != state.get("hash"):
+            added, removed, moved = await AsyncDatabase(DB_NAME).sync_schedules(SCHEDULES_FILE)
+            print(f"🔄 Розклад оновлено: додано {added}, видалено {removed}, перенесено {moved}.")
+
+        # Remembered only after success, so a failed attempt is retried on the next run
+        state["mtime"] = mtime
+        state["hash"] = content_hash
+    except (OSError, ValueError) as e:
+        print(f"❌ Не вдалося прочитати {SCHEDULES_FILE}: {e}")
+    except DatabaseException as e:
+        print(f"❌ Помилка оновлення розкладу: {e}")
+
 async def auto_archive_job(context: ContextTypes.DEFAULT_TYPE):
     yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
     
     try:
-        with Database(DB_NAME) as db:
-            archived_count = db.archive_past_queues(yesterday)
-            
-            if archived_count > 0:
-                print(f"🔄 Автоматично архівовано {archived_count} черг за {yesterday}.")
-                
+        # Everything up to yesterday, so queues from days the bot was down are archived too
+        archived = await AsyncDatabase(DB_NAME).archive_past_queues(yesterday)
+
+        if archived:
+            print(f"🔄 Автоматично архівовано {len(archived)} черг ({sum(archived.values())} записів) "
+                  f"до {yesterday} включно.")
+
     except DatabaseException as e:
         print(f"❌ Помилка авто-архівування: {e}")
         
+async def drain_outbox(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        await outbox_worker.drain(context.bot, DB_NAME)
+    except DatabaseException as e:
+        print(f"❌ Помилка обробки черги повідомлень: {e}")
+
+def kick_outbox(context: ContextTypes.DEFAULT_TYPE):
+    """Starts draining right away instead of waiting for the next poll"""
+    context.job_queue.run_once(instrument(drain_outbox, "job"), 0)
+
+async def notify(context: ContextTypes.DEFAULT_TYPE, chat_id: int, text: str):
+    """Sends a message through the outbox"""
+    try:
+        await enqueue(DB_NAME, [(chat_id, text)])
+        kick_outbox(context)
+    except DatabaseException as e:
+        print(f"❌ Помилка постановки повідомлення у чергу: {e}")
+
+async def purge_outbox_job(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        deleted = await AsyncDatabase(DB_NAME).purge_outbox(OUTBOX_RETENTION_DAYS)
+        if deleted:
+            print(f"🧹 Видалено {deleted} старих повідомлень з черги відправки.")
+    except DatabaseException as e:
+        print(f"❌ Помилка очищення черги повідомлень: {e}")
+
+async def reconcile_registered_users(context: ContextTypes.DEFAULT_TYPE):
+    snapshot_version = registered_users.version
+
+    try:
+        user_ids = await AsyncDatabase(DB_NAME).get_all_user_ids()
+    except DatabaseException as e:
+        print(f"❌ Помилка звірки кешу користувачів: {e}")
+        return
+
+    drift = registered_users.reconcile(user_ids, snapshot_version)
+    if drift:
+        print(f"🔄 Кеш користувачів виправлено: {drift} розбіжностей "
+              f"(влучань: {registered_users.hits}, промахів: {registered_users.misses})")
+
 async def check_tomorrows_schedules(context: ContextTypes.DEFAULT_TYPE):
     tomorrow = datetime.now() + timedelta(days=1)
     formatted_tomorrow = tomorrow.strftime("%Y-%m-%d")
@@ -668,61 +929,245 @@ async def check_tomorrows_schedules(context: ContextTypes.DEFAULT_TYPE):
     user_ids = []
 
     try:
-        with Database(DB_NAME) as db:
-            schedule_ids = db.get_schedules_for_date(formatted_tomorrow)
+        db = AsyncDatabase(DB_NAME)
+        schedules = await db.get_schedules_with_subjects_for_date(formatted_tomorrow)
 
-            if not schedule_ids:
-                return 
+        if not schedules:
+            return 
 
-            user_ids = db.get_user_ids()
-
-            for schedule_id in schedule_ids:
-                db.update_active_queues(schedule_id)
-                subject, subgroup = db.get_subject_name_and_subgroup(schedule_id)
-                
-                text = f"📢 Відкрито чергу на завтра:\n📚 Предмет: {subject}\n👥 Підгрупа: {subgroup}"
-                messages_to_send.append(text)
+        user_ids = await db.get_user_ids()
+        await db.open_active_queues([schedule_id for schedule_id, _, _ in schedules])
 
     except DatabaseException as e:
         print(f"Помилка БД при перевірці черг на завтра: {e}")
         return
 
+    for _, subject, subgroup in schedules:
+        text = f"📢 Відкрито чергу на завтра:\n📚 Предмет: {subject}\n👥 Підгрупа: {subgroup}"
+        messages_to_send.append(text)
+
     if user_ids and messages_to_send:
         final_text = "\n\n".join(messages_to_send)
-        
-        for user_id in user_ids:
-            try:
-                await context.bot.send_message(chat_id=user_id, text=final_text)
-            except Exception:
-                pass
 
-def main() -> None:
+        try:
+            await enqueue(DB_NAME, [(user_id, final_text) for user_id in user_ids])
+        except DatabaseException as e:
+            print(f"Помилка БД при розсилці черг на завтра: {e}")
+            return
+
+        kick_outbox(context)
+
+async def count_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.callback_query:
+        updates_received.inc(type="callback_query")
+    elif update.message:
+        updates_received.inc(type="message")
+    else:
+        updates_received.inc(type="other")
+
+async def track_activity(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user:
+        state_sweeper.touch(update.effective_user.id)
+
+async def drop_duplicate_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Answers a repeated tap on the same button right away instead of running its handler again.
+    Runs after the throttle, so a rejected tap is never recorded; handlers call forget_tap when they fail.
+    """
+    query = update.callback_query
+    if not query or not query.data or not query.message:
+        return
+
+    if recent_callbacks.is_duplicate(query.from_user.id, query.message.message_id, query.data):
+        try:
+            await query.answer()
+        except BadRequest:
+            pass
+        raise ApplicationHandlerStop
+
+def forget_tap(query):
+    """Lets the user retry a tap whose handling failed without it being dropped as a duplicate"""
+    if query.message:
+        recent_callbacks.forget(query.from_user.id, query.message.message_id, query.data)
+
+async def throttle_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Stops updates over their THROTTLE_RULES limit before any handler, and so the database, sees them"""
+    rule = throttle.rule_for(update)
+    if rule is None or not update.effective_user:
+        return
+
+    user_id = update.effective_user.id
+    if throttle.check(user_id, rule):
+        return
+
+    # The user is told once, further excess updates are dropped silently
+    warn = throttle.should_warn(user_id, rule)
+    try:
+        if update.callback_query:
+            await update.callback_query.answer("⏳ Забагато натискань, зачекай трохи." if warn else None)
+        elif warn:
+            await update.message.reply_text("⏳ Забагато запитів, зачекай трохи.")
+    except BadRequest:
+        pass
+    raise ApplicationHandlerStop
+
+def timeout_handler(*owned_keys: str) -> TypeHandler:
+    """
+    Handler for the TIMEOUT state of a conversation: runs when a dialog got no answer for
+    CONVERSATION_TIMEOUT seconds and drops only the user_data keys that conversation owns.
+    """
+    async def conversation_timed_out(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        for key in owned_keys:
+            context.user_data.pop(key, None)
+        if update.effective_chat:
+            await notify(context, update.effective_chat.id, "⌛ Час на відповідь вичерпано, дію скасовано.")
+
+    return TypeHandler(Update, conversation_timed_out)
+
+async def sweep_state_job(context: ContextTypes.DEFAULT_TYPE):
+    """Drops user_data of long inactive users and registration requests nobody answered"""
+    app = context.application
+
+    evicted_users = state_sweeper.users_to_evict(app.user_data)
+    for user_id in evicted_users:
+        app.drop_user_data(user_id)
+        state_sweeper.forget(user_id)
+
+    expired = StateSweeper.expired_registrations(app.bot_data, PENDING_REGISTRATION_TTL)
+    for user_id in expired:
+        # Popped before the await, same as in admin_registration_decision
+        if app.bot_data.pop(user_id, None) is not None:
+            await notify(context, user_id, "⌛ Твою заявку на реєстрацію не розглянули вчасно. "
+                                           "Надішли /start, щоб подати її ще раз.")
+
+    if evicted_users or expired:
+        state_evicted.inc(len(evicted_users), kind="user_data")
+        state_evicted.inc(len(expired), kind="registration")
+        print(f"🧹 Очищено стан: користувачів {len(evicted_users)}, заявок {len(expired)}")
+
+    conversations = [h for h in app.handlers.get(0, []) if isinstance(h, ConversationHandler)]
+    state_entries.set(len(app.user_data), kind="user_data")
+    state_entries.set(sum(isinstance(key, int) for key in app.bot_data), kind="registration")
+    state_entries.set(sum(len(h.timeout_jobs) for h in conversations), kind="conversation")
+    state_bytes.set(deep_sizeof(dict(app.user_data)), kind="user_data")
+    state_bytes.set(deep_sizeof(dict(app.bot_data)), kind="bot_data")
+
+async def start_metrics(app: Application):
+    await metrics_server.start()
+    task = asyncio.create_task(measure_event_loop_lag(EVENT_LOOP_LAG_INTERVAL))
+    background_tasks.add(task)
+    print(f"Metrics: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+async def stop_metrics(app: Application):
+    for task in background_tasks:
+        task.cancel()
+    background_tasks.clear()
+    await metrics_server.stop()
+
+def init_database():
+    if DB_QUERY_STATS:
+        query_stats.db_file = DB_NAME
+        add_query_hook(query_stats)
+
     # Creating database
     with Database(DB_NAME) as db:
         db.create_database()
-        db.seed_initial_data()
+        db.seed_initial_data(SCHEDULES_FILE)
+
+        for problem in db.check_query_plans():
+            print(f"⚠️ Запит без індексу: {problem}")
+
+        registered_users.load(db.get_all_user_ids())
+
+def stored_schedules_hash() -> str | None:
+    with Database(DB_NAME) as db:
+        return db.get_meta("schedules_hash")
+
+def iter_handlers(handlers):
+    """Yields handlers, including the ones nested in ConversationHandlers"""
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            yield from iter_handlers(handler.entry_points)
+            for state_handlers in handler.states.values():
+                yield from iter_handlers(state_handlers)
+            yield from iter_handlers(handler.fallbacks)
+        else:
+            yield handler
+
+def get_allowed_updates(app: Application) -> list[str]:
+    """Update types the registered handlers can react to, so Telegram doesn't send the rest"""
+    allowed_updates = set()
+    for handler in iter_handlers(h for group in app.handlers.values() for h in group):
+        if isinstance(handler, CallbackQueryHandler):
+            allowed_updates.add(Update.CALLBACK_QUERY)
+        elif isinstance(handler, (CommandHandler, MessageHandler)):
+            allowed_updates.add(Update.MESSAGE)
+    return sorted(allowed_updates)
+
+def build_application(token: str = TOKEN, base_url: str = None) -> Application:
+    """Creates the Application with all jobs and handlers. base_url points it to another Bot API server"""
+    # Different users are served in parallel, each user's updates one at a time
+    builder = Application.builder().token(token).concurrent_updates(PerUserUpdateProcessor(UPDATE_CONCURRENCY))
+    if base_url:
+        builder = builder.base_url(base_url)
+    if METRICS_ENABLED:
+        builder = builder.post_init(start_metrics).post_shutdown(stop_metrics)
+    if PERSISTENCE_ENABLED:
+        # Conversation states, user_data and pending registrations survive restarts
+        builder = builder.persistence(SQLitePersistence(DB_NAME))
 
     # Here bot runs
-    app = (
-            Application.builder()
-            .token(TOKEN)
-            .build()
-        )
+    app = builder.build()
 
     # Schedule the daily job
     time_to_run = time(hour=3, minute=0)
 
     app.job_queue.run_daily(
-        check_tomorrows_schedules,
+        instrument(check_tomorrows_schedules, "job"),
         time=time_to_run,
         name="daily_schedule_check"
     )
     
     app.job_queue.run_daily(
-        auto_archive_job,
+        instrument(auto_archive_job, "job"),
         time=time_to_run,
         name="auto_archive_job"
     )
+
+    app.job_queue.run_repeating(
+        instrument(reconcile_registered_users, "job"),
+        interval=REGISTERED_USERS_RECONCILE_INTERVAL,
+        name="reconcile_registered_users"
+    )
+
+    # Sends whatever is pending in the outbox, including messages left from before a restart
+    app.job_queue.run_repeating(
+        instrument(drain_outbox, "job"),
+        interval=OUTBOX_POLL_INTERVAL,
+        first=0,
+        name="drain_outbox"
+    )
+
+    if SCHEDULES_WATCH_INTERVAL:
+        app.job_queue.run_repeating(
+            instrument(watch_schedules_job, "job"),
+            interval=SCHEDULES_WATCH_INTERVAL,
+            # What the database was last synced with, so a change it missed is applied on the first run
+            data={"mtime": None, "hash": stored_schedules_hash()},
+            name="watch_schedules"
+        )
+
+    app.job_queue.run_daily(
+        instrument(purge_outbox_job, "job"),
+        time=time_to_run,
+        name="purge_outbox"
+    )
+
+    app.job_queue.run_repeating(
+        instrument(sweep_state_job, "job"),
+        interval=STATE_SWEEP_INTERVAL,
+        name="sweep_state"
+    )
     
 
     # Filter for admins
@@ -730,19 +1175,25 @@ def main() -> None:
     registered_filter = IsRegisteredUserFilter()
 
     # Here adding reaction to commands
+    # (unfinished dialogs end after CONVERSATION_TIMEOUT seconds of silence, see timeout_handler)
     registration_conv = ConversationHandler(
         entry_points=[CommandHandler("start", start)],
         states={
-            WAITING_FOR_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, receive_name)]
+            WAITING_FOR_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, receive_name)],
+            ConversationHandler.TIMEOUT: [timeout_handler()]
         },
         fallbacks=[CommandHandler("cancel", cancel_registration)],
-        allow_reentry=True
+        allow_reentry=True,
+        name="registration",
+        persistent=PERSISTENCE_ENABLED,
+        conversation_timeout=CONVERSATION_TIMEOUT
     )
     app.add_handler(registration_conv)
     app.add_handler(CallbackQueryHandler(admin_registration_decision, pattern="^(approve|reject)_"))
 
 
     app.add_handler(CommandHandler("show_table", show_table, filters=registered_filter))
+    app.add_handler(CallbackQueryHandler(queue_to_show_selected, pattern="^show_t_"))
 
     queue_conv = ConversationHandler(
         entry_points=[CommandHandler("get_in_queue", get_in_queue, filters=registered_filter)],
@@ -752,10 +1203,17 @@ def main() -> None:
                 CallbackQueryHandler(position_selected, pattern="^cancel_queue$")
             ],
             TYPING_LAB_NUMBER: [MessageHandler(filters.TEXT & ~filters.COMMAND, receive_lab_number)],
-            SELECTING_POSITION: [CallbackQueryHandler(position_selected, pattern="^(pos_|taken_pos|cancel_queue)")]
+            SELECTING_POSITION: [
+                CallbackQueryHandler(position_selected, pattern="^(pos_|taken_pos|cancel_queue)"),
+                CallbackQueryHandler(position_page_selected, pattern="^pospage_")
+            ],
+            ConversationHandler.TIMEOUT: [timeout_handler('selected_schedule_id', 'lab_number')]
         },
         fallbacks=[CommandHandler("cancel", cancel_queue)],
-        allow_reentry=True
+        allow_reentry=True,
+        name="get_in_queue",
+        persistent=PERSISTENCE_ENABLED,
+        conversation_timeout=CONVERSATION_TIMEOUT
     )
     app.add_handler(queue_conv)
 
@@ -765,10 +1223,14 @@ def main() -> None:
             SELECTING_QUEUE_FOR_LEAVING: [
                 CallbackQueryHandler(queue_for_leaving_selected, pattern="^leave_"),
                 CallbackQueryHandler(cancel_leave, pattern="^cancel_leave$")
-            ]
+            ],
+            ConversationHandler.TIMEOUT: [timeout_handler()]
         },
         fallbacks=[CommandHandler("cancel", cancel_leave)],
-        allow_reentry=True
+        allow_reentry=True,
+        name="leave_queue",
+        persistent=PERSISTENCE_ENABLED,
+        conversation_timeout=CONVERSATION_TIMEOUT
     )
     app.add_handler(leave_queue_conv)
 
@@ -779,10 +1241,14 @@ def main() -> None:
             SELECTING_QUEUE_TO_CLOSE: [
                 CallbackQueryHandler(queue_to_close_selected, pattern="^close_q_"),
                 CallbackQueryHandler(cancel_close, pattern="^cancel_close$")
-            ]
+            ],
+            ConversationHandler.TIMEOUT: [timeout_handler()]
         },
         fallbacks=[CommandHandler("cancel", cancel_close)],
-        allow_reentry=True
+        allow_reentry=True,
+        name="close_queue",
+        persistent=PERSISTENCE_ENABLED,
+        conversation_timeout=CONVERSATION_TIMEOUT
     )
     app.add_handler(close_queue_conv)
 
@@ -796,10 +1262,14 @@ def main() -> None:
             SELECTING_USER_TO_REMOVE: [
                 CallbackQueryHandler(user_to_remove_selected, pattern="^rm_usr_"),
                 CallbackQueryHandler(cancel_remove, pattern="^cancel_rm$")
-            ]
+            ],
+            ConversationHandler.TIMEOUT: [timeout_handler('rm_schedule_id')]
         },
         fallbacks=[CommandHandler("cancel", cancel_remove)],
-        allow_reentry=True
+        allow_reentry=True,
+        name="remove_user",
+        persistent=PERSISTENCE_ENABLED,
+        conversation_timeout=CONVERSATION_TIMEOUT
     )
     app.add_handler(remove_user_conv)
 
@@ -807,12 +1277,52 @@ def main() -> None:
     
     app.add_handler(CommandHandler("reschedule", reschedule, filters=admin_filter & registered_filter))
 
+    app.add_handler(CommandHandler("set_capacity", set_capacity, filters=admin_filter & registered_filter))
+
     app.add_handler(CommandHandler("broadcast", broadcast, filters=admin_filter & registered_filter))
 
     app.add_handler(CommandHandler("toggle_registration", toggle_registration, filters=admin_filter & registered_filter))
 
-    print("Bot is running...")
-    app.run_polling(allowed_updates=Update.ALL_TYPES)
+    app.add_handler(CommandHandler("reload_schedules", reload_schedules, filters=admin_filter & registered_filter))
+
+    app.add_handler(CommandHandler("db_stats", db_stats, filters=admin_filter & registered_filter))
+
+    # Latency, errors and in-flight count of every callback
+    for handler in iter_handlers(h for group in app.handlers.values() for h in group):
+        handler.callback = instrument(handler.callback)
+
+    # Sees every update before the other groups, never stops them
+    app.add_handler(TypeHandler(Update, count_update), group=-100)
+    app.add_handler(TypeHandler(Update, track_activity), group=-99)
+
+    # Stop excess updates and repeated taps before the handlers; the throttle first,
+    # so a tap it rejects isn't remembered and the retry isn't taken for a duplicate
+    if THROTTLE_ENABLED:
+        app.add_handler(TypeHandler(Update, throttle_update), group=-2)
+    if DEDUP_ENABLED:
+        app.add_handler(TypeHandler(Update, drop_duplicate_callback), group=-1)
+
+    return app
+
+def main() -> None:
+    init_database()
+
+    app = build_application()
+    allowed_updates = get_allowed_updates(app)
+
+    if WEBHOOK_ENABLED:
+        print("Bot is running (webhook)...")
+        app.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET_TOKEN,
+            allowed_updates=allowed_updates
+        )
+    else:
+        print("Bot is running...")
+        app.run_polling(allowed_updates=allowed_updates)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
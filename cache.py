@@ -0,0 +1,178 @@
+import threading
+
+
+class RegisteredUsersCache:
+    """
+    Process-local set of registered user ids.
+    Loaded once at startup and updated by the Database methods that add or delete users,
+    so membership checks never touch SQLite.
+    """
+    def __init__(self):
+        self._user_ids = set()
+        self._lock = threading.Lock()
+
+        self.loaded = False
+        self.version = 0  # bumped on every write-through update
+
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, user_ids):
+        with self._lock:
+            self._user_ids = set(user_ids)
+            self.loaded = True
+            self.version += 1
+
+    def add(self, user_id: int):
+        with self._lock:
+            self._user_ids.add(user_id)
+            self.version += 1
+
+    def discard(self, user_id: int):
+        with self._lock:
+            self._user_ids.discard(user_id)
+            self.version += 1
+
+    def contains(self, user_id: int) -> bool:
+        if user_id in self._user_ids:
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def reconcile(self, user_ids, snapshot_version: int) -> int | None:
+        """
+        Replaces the set with a fresh snapshot from the database.
+        snapshot_version is the cache version read before the snapshot was taken: if users were
+        added or deleted meanwhile the snapshot may be stale, so nothing is changed and None is returned.
+        Otherwise returns the number of entries that had drifted.
+        """
+        user_ids = set(user_ids)
+        with self._lock:
+            if snapshot_version != self.version:
+                return None
+            drift = len(user_ids ^ self._user_ids)
+            self._user_ids = user_ids
+            self.loaded = True
+            return drift
+
+    def __len__(self):
+        return len(self._user_ids)
+
+
+registered_users = RegisteredUsersCache()
+
+
+class VersionedCache:
+    """
+    Entries keyed by id (None for a cache of a single value), each with a version that Database bumps
+    whenever the data behind the entry changes. Readers take the version before reading the database,
+    and what they read is stored only if the version is still the same, so a stale read is never cached.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counter = 0
+        self._versions = {}  # key -> version
+        self._entries = {}  # key -> cached value
+
+        self.hits = 0
+        self.misses = 0
+
+    def version(self, key=None) -> int:
+        return self._versions.get(key, 0)
+
+    def _bump(self, key):
+        """Called with the lock held"""
+        self._counter += 1
+        self._versions[key] = self._counter
+
+    def _store(self, key, version: int, value):
+        with self._lock:
+            if version == self.version(key):
+                self._entries[key] = value
+
+    def get(self, key=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def invalidate(self, key=None):
+        with self._lock:
+            self._bump(key)
+            self._entries.pop(key, None)
+
+
+class QueueTableCache(VersionedCache):
+    """Rendered queue tables keyed by schedule_id"""
+    def put(self, schedule_id: int, version: int, text: str):
+        """Stores text rendered from data read at `version`; dropped if the queue changed since"""
+        self._store(schedule_id, version, text)
+
+
+queue_tables = QueueTableCache()
+
+
+class TakenPositionsCache(VersionedCache):
+    """
+    Per-schedule bitmap of taken queue positions (bit p set = position p taken) and the queue capacity.
+    Database sets and clears bits as positions are claimed and freed, so the position keyboard
+    is built without reading the queue.
+    """
+    def put(self, schedule_id: int, version: int, capacity: int, positions) -> tuple[int, int]:
+        """Builds the bitmap from positions read at `version`, caches it if still current and returns it"""
+        bitmap = 0
+        for position in positions:
+            bitmap |= 1 << position
+
+        self._store(schedule_id, version, (capacity, bitmap))
+        return capacity, bitmap
+
+    def take(self, schedule_id: int, position: int):
+        with self._lock:
+            self._bump(schedule_id)
+            entry = self._entries.get(schedule_id)
+            if entry:
+                self._entries[schedule_id] = (entry[0], entry[1] | 1 << position)
+
+    def release(self, schedule_id: int, position: int):
+        with self._lock:
+            self._bump(schedule_id)
+            entry = self._entries.get(schedule_id)
+            if entry:
+                self._entries[schedule_id] = (entry[0], entry[1] & ~(1 << position))
+
+
+taken_positions = TakenPositionsCache()
+
+
+class ActiveQueuesCache(VersionedCache):
+    """
+    The open queues as Database.get_current_active_queues returns them (the single entry, key None),
+    plus menus built from them, kept only while the snapshot they were built from is current.
+    """
+    def __init__(self):
+        super().__init__()
+        self._menus = {}  # kind -> menu built from the current snapshot
+
+    def invalidate(self, key=None):
+        super().invalidate(key)
+        with self._lock:
+            self._menus.clear()
+
+    def put(self, version: int, queues: list[tuple]):
+        """Stores queues read at `version`; dropped if they changed since"""
+        self._store(None, version, queues)
+
+    def get_menu(self, kind: str):
+        return self._menus.get(kind)
+
+    def put_menu(self, kind: str, version: int, menu):
+        with self._lock:
+            if version == self.version():
+                self._menus[kind] = menu
+
+
+active_queues = ActiveQueuesCache()
@@ -7,3 +7,96 @@ admins = {
 }
 
 DB_NAME = "DB_NAME"
+
+# Connection pool
+DB_POOL_SIZE = 5
+DB_POOL_TIMEOUT = 10  # seconds to wait for a free connection
+
+# Broadcasts (Telegram allows about 30 messages per second overall and 1 per second per chat)
+BROADCAST_CONCURRENCY = 10
+SEND_RATE_PER_SECOND = 25
+SEND_RATE_PER_CHAT = 1
+SEND_MAX_RETRIES = 3  # retries after flood-control responses
+BROADCAST_PROGRESS_INTERVAL = 3  # seconds between progress message edits
+
+# Registered users cache
+REGISTERED_USERS_RECONCILE_INTERVAL = 600  # seconds between full reloads from Users
+
+# Notification outbox
+OUTBOX_POLL_INTERVAL = 5  # seconds between drains of the Outbox table
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_MAX_ATTEMPTS = 5  # after that a message is dead-lettered
+OUTBOX_BACKOFF_BASE = 10  # seconds before the first retry, doubled every attempt
+OUTBOX_BACKOFF_MAX = 3600
+OUTBOX_RETENTION_DAYS = 7  # sent and dead-lettered messages are purged after that
+
+# Storage mode
+DB_JOURNAL_MODE = "WAL"  # "DELETE" is SQLite's default rollback journal
+DB_SYNCHRONOUS = "NORMAL"  # safe with WAL, "FULL" fsyncs on every commit
+DB_BUSY_TIMEOUT = 5000  # ms to wait for a lock before failing
+DB_GROUP_COMMIT = True  # route all writes through one writer thread
+DB_GROUP_COMMIT_MAX_BATCH = 200  # writes queued while a commit runs go into the next one, up to that many
+DB_WRITE_TIMEOUT = 30  # seconds a caller waits for its write to be committed
+
+# Query statistics (/db_stats)
+DB_QUERY_STATS = True  # time every statement, costs a few microseconds per query
+DB_SLOW_QUERY_MS = 100  # statements slower than that go to the slow-query log
+DB_SLOW_QUERY_LOG = "slow_queries.log"  # None to print them instead
+
+# Queue positions
+DEFAULT_QUEUE_CAPACITY = 25  # positions in a queue unless /set_capacity says otherwise
+MAX_QUEUE_CAPACITY = 1000
+POSITIONS_PER_PAGE = 25  # buttons on one page of the position picker
+POSITIONS_PER_ROW = 5
+
+# Update processing
+UPDATE_CONCURRENCY = 32  # updates processed at once; one user's updates always run one at a time
+
+# Persistence of conversations, user_data and pending registrations
+PERSISTENCE_ENABLED = True
+PERSISTENCE_UPDATE_INTERVAL = 5  # seconds between writes of changed state
+
+# Throttling: (actions per second, burst) per user for "/command" or callback data prefix
+THROTTLE_ENABLED = True
+THROTTLE_RULES = {
+    "/get_in_queue": (0.2, 3),
+    "/leave_the_queue": (0.2, 3),
+    "/show_table": (0.5, 5),
+    "get_in_": (0.5, 3),
+    "pos_": (0.5, 3),
+    "pospage_": (2, 10),
+    "leave_": (0.5, 3),
+    "show_t_": (0.5, 5),
+}
+THROTTLE_GLOBAL_RATE = 100  # all throttled updates of all users together
+THROTTLE_GLOBAL_BURST = 300
+
+# Repeated taps on the same button of the same message within the window are dropped
+DEDUP_ENABLED = True
+DEDUP_WINDOW = 3  # seconds
+DEDUP_PREFIXES = ("pos_", "leave_", "rm_usr_", "approve_", "reject_")
+
+# Stale state eviction
+CONVERSATION_TIMEOUT = 600  # seconds without an answer after which an unfinished dialog is cancelled
+STATE_SWEEP_INTERVAL = 300
+USER_DATA_TTL = 3600  # user_data of users inactive that long is dropped
+USER_DATA_MAX_USERS = 5000  # beyond that the least recently active users are dropped too
+PENDING_REGISTRATION_TTL = 3 * 24 * 3600  # unanswered registration requests expire after that
+
+# Prometheus metrics endpoint
+METRICS_ENABLED = True
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108  # served at http://METRICS_HOST:METRICS_PORT/metrics
+EVENT_LOOP_LAG_INTERVAL = 0.5  # seconds between event loop lag measurements
+
+# Schedules
+SCHEDULES_FILE = "schedules.json"
+SCHEDULES_WATCH_INTERVAL = 60  # seconds between checks for changes, 0 to disable
+
+# Webhook mode (instead of long polling)
+WEBHOOK_ENABLED = False
+WEBHOOK_URL = "https://example.com"  # public base URL Telegram sends updates to
+WEBHOOK_PATH = "webhook"
+WEBHOOK_LISTEN = "0.0.0.0"  # local HTTP listener
+WEBHOOK_PORT = 8443
+WEBHOOK_SECRET_TOKEN = "WEBHOOK_SECRET_TOKEN"  # checked on every incoming request
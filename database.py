@@ -1,18 +1,410 @@
+import queue
 import sqlite3
+import threading
+import time
 
-from datetime import datetime
-from schedule_parser import parse_json
-from config import admins
+from collections import defaultdict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from schedule_parser import iter_schedules, file_hash, to_db_date
+from config import (admins, DB_POOL_SIZE, DB_POOL_TIMEOUT, DB_JOURNAL_MODE, DB_SYNCHRONOUS, DB_BUSY_TIMEOUT,
+                    DB_GROUP_COMMIT, DB_GROUP_COMMIT_MAX_BATCH, DB_WRITE_TIMEOUT, DEFAULT_QUEUE_CAPACITY)
 
 from exception import DatabaseException
+from cache import registered_users, queue_tables, taken_positions, active_queues
+
+# Called after every statement as hook(conn, query, parameters, seconds, error)
+_query_hooks = []
+
+
+def add_query_hook(hook):
+    """Registers a callback that is told about every statement run through Database, e.g. QueryStats"""
+    _query_hooks.append(hook)
+
+
+def remove_query_hook(hook):
+    _query_hooks.remove(hook)
+
+
+def timed(conn: sqlite3.Connection, query: str, parameters, run):
+    """Returns run() and reports how long it took to the query hooks"""
+    if not _query_hooks:
+        return run()
+
+    error = None
+    started = time.perf_counter()
+    try:
+        return run()
+    except sqlite3.Error as e:
+        error = e
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        for hook in _query_hooks:
+            try:
+                hook(conn, query, parameters, elapsed, error)
+            except Exception as e:
+                print(f"Помилка обробника запитів: {e}")
+
+
+class TimedCursor:
+    """
+    Cursor passed to transaction functions while query hooks are registered:
+    execute and executemany are reported to the hooks, everything else goes to the real cursor.
+    """
+    def __init__(self, cursor: sqlite3.Cursor):
+        self._cursor = cursor
+
+    def execute(self, query: str, parameters=()):
+        timed(self._cursor.connection, query, parameters, lambda: self._cursor.execute(query, parameters))
+        return self
+
+    def executemany(self, query: str, seq_of_parameters):
+        timed(self._cursor.connection, query, None, lambda: self._cursor.executemany(query, seq_of_parameters))
+        return self
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class GroupCommitWriter:
+    """
+    The single writer thread of a database file.
+    Leader-style group commit: whenever the thread is free it commits everything queued
+    by then in one transaction, so a burst of writes pays for one commit and a lone write
+    doesn't wait for company. Every job runs in its own savepoint: a failing job is rolled
+    back alone and the rest of the group is still committed.
+    """
+    def __init__(self, conn: sqlite3.Connection, max_batch: int = DB_GROUP_COMMIT_MAX_BATCH,
+                 timeout: float = DB_WRITE_TIMEOUT):
+        self.conn = conn
+        self.conn.isolation_level = None  # transactions are managed explicitly
+        self.max_batch = max_batch
+        self.timeout = timeout
+
+        self._jobs = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, func):
+        """
+        Runs func(cursor) on the writer thread and returns its result once it is committed.
+        Raises DatabaseException if that takes longer than timeout seconds (the write may still happen later).
+        """
+        future = Future()
+        self._jobs.put((func, future))
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            raise DatabaseException(f"Write not committed within {self.timeout} s")
+
+    def stop(self):
+        self._jobs.put(None)
+        self._thread.join()
+        self.conn.close()
+
+    def _run(self):
+        cursor = self.conn.cursor()
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+
+            batch = [job]
+            is_stopping = self._collect(batch)
+            try:
+                self._commit(cursor, batch)
+            except Exception as e:
+                # Never let the thread die: every later write would wait forever
+                print(f"Group commit failed: {e}")
+                self._abort(batch, DatabaseException(f"Query failed: {e}"))
+            if is_stopping:
+                return
+
+    def _collect(self, batch: list) -> bool:
+        """Adds the jobs already queued to batch, returns True if stop was requested"""
+        while len(batch) < self.max_batch:
+            try:
+                job = self._jobs.get_nowait()
+            except queue.Empty:
+                return False
+            if job is None:
+                return True
+            batch.append(job)
+        return False
+
+    def _abort(self, batch: list, error: Exception):
+        """Fails every job of the batch that has no outcome yet and ends the transaction if it is still open"""
+        if self.conn.in_transaction:
+            try:
+                self.conn.rollback()
+            except sqlite3.Error:
+                pass
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(error)
+
+    def _commit(self, cursor: sqlite3.Cursor, batch: list):
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+        except sqlite3.Error as e:
+            self._abort(batch, DatabaseException(f"Query failed: {e}"))
+            return
+
+        done = []
+        for func, future in batch:
+            cursor.execute("SAVEPOINT job")
+            try:
+                result = func(cursor)
+                cursor.execute("RELEASE job")
+                done.append((future, result))
+            except Exception as e:
+                if isinstance(e, sqlite3.Error):
+                    print(f"Query failed: {e}")
+                    e = DatabaseException(f"Query failed: {e}")
+                future.set_exception(e)
+
+                if not self.conn.in_transaction:
+                    # SQLite rolled the whole transaction back by itself (SQLITE_FULL, IOERR, ...):
+                    # the savepoint and the work of the jobs before are gone
+                    self._abort(batch, DatabaseException(f"Transaction rolled back: {e}"))
+                    return
+                cursor.execute("ROLLBACK TO job")
+                cursor.execute("RELEASE job")
+
+        try:
+            cursor.execute("COMMIT")
+        except sqlite3.Error as e:
+            self._abort(batch, DatabaseException(f"Commit failed: {e}"))
+            return
+
+        for future, result in done:
+            future.set_result(result)
+
+
+class ConnectionPool:
+    """
+    Bounded pool of configured sqlite3 connections for one database file.
+    Connections are checked out by Database and returned on close.
+    With group_commit all writes go through one GroupCommitWriter instead.
+    """
+    def __init__(self, db_file: str, max_size: int = DB_POOL_SIZE, timeout: float = DB_POOL_TIMEOUT,
+                 journal_mode: str = DB_JOURNAL_MODE, synchronous: str = DB_SYNCHRONOUS,
+                 busy_timeout: int = DB_BUSY_TIMEOUT, group_commit: bool = DB_GROUP_COMMIT):
+        self.db_file = db_file
+        self.max_size = max_size
+        self.timeout = timeout
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.busy_timeout = busy_timeout
+
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_size)
+
+        self.writer = GroupCommitWriter(self._connect()) if group_commit else None
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        conn.execute("PRAGMA foreign_keys = ON;")
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout)};")
+        conn.execute(f"PRAGMA journal_mode = {self.journal_mode};")
+        conn.execute(f"PRAGMA synchronous = {self.synchronous};")
+        return conn
+
+    @staticmethod
+    def _is_healthy(conn: sqlite3.Connection) -> bool:
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    @staticmethod
+    def _discard(conn: sqlite3.Connection):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def checkout(self) -> sqlite3.Connection:
+        """Returns an idle healthy connection or opens a new one if the pool is not full"""
+        if not self._slots.acquire(timeout=self.timeout):
+            raise DatabaseException("Database Error: connection pool exhausted")
+
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+
+            if self._is_healthy(conn):
+                return conn
+
+            # Broken connection: replace it with a fresh one
+            self._discard(conn)
+            return self._connect()
+        except sqlite3.Error as e:
+            self._slots.release()
+            raise DatabaseException(f"Connection failed: {e}")
+
+    def checkin(self, conn: sqlite3.Connection):
+        """Returns connection to the pool, rolling back anything left uncommitted"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put_nowait(conn)
+        except sqlite3.Error:
+            self._discard(conn)
+        finally:
+            self._slots.release()
+
+    def close_all(self):
+        if self.writer:
+            self.writer.stop()
+            self.writer = None
+
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(conn)
+
+
+_pools: dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_file: str) -> ConnectionPool:
+    """Returns the process-wide pool for db_file, creating it on first use"""
+    with _pools_lock:
+        pool = _pools.get(db_file)
+        if pool is None:
+            pool = ConnectionPool(db_file)
+            _pools[db_file] = pool
+        return pool
+
+
+def configure_pool(db_file: str, **settings) -> ConnectionPool:
+    """Replaces the pool for db_file with one using custom ConnectionPool settings"""
+    with _pools_lock:
+        old_pool = _pools.pop(db_file, None)
+        if old_pool:
+            old_pool.close_all()
+
+        pool = ConnectionPool(db_file, **settings)
+        _pools[db_file] = pool
+        return pool
+
+
+# Ordered schema migrations: (version, description, statements).
+# Never edit an applied migration, append a new one instead.
+MIGRATIONS = [
+    (1, "unique queue positions", [
+        # Keep the earliest sign-up for positions that were double booked
+        """DELETE FROM Queues
+           WHERE position IS NOT NULL
+             AND id NOT IN (SELECT MIN(id) FROM Queues WHERE position IS NOT NULL GROUP BY schedule_id, position)""",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_queues_schedule_position ON Queues (schedule_id, position)",
+    ]),
+    (2, "indexes for hot queries", [
+        "CREATE INDEX IF NOT EXISTS idx_queues_user ON Queues (user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_queues_schedule_user_lab ON Queues (schedule_id, user_id, lab_number)",
+        "CREATE INDEX IF NOT EXISTS idx_schedules_defense_date ON Schedules (defense_date)",
+        # Foreign key actions on Archive look rows up by these columns
+        "CREATE INDEX IF NOT EXISTS idx_archive_schedule ON Archive (schedule_id)",
+        "CREATE INDEX IF NOT EXISTS idx_archive_user ON Archive (user_id)",
+    ]),
+    (3, "users who blocked the bot", [
+        "ALTER TABLE Users ADD COLUMN is_blocked INTEGER DEFAULT 0",  # 0 for False, 1 for True
+    ]),
+    (4, "notification outbox", [
+        """CREATE TABLE IF NOT EXISTS Outbox_Batches (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL, -- where the progress message lives
+            message_id INTEGER NOT NULL,
+            total INTEGER NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP)""",
+        """CREATE TABLE IF NOT EXISTS Outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            reply_markup TEXT, -- JSON
+            batch_id INTEGER,
+            status TEXT NOT NULL DEFAULT 'pending', -- pending, sent, blocked, dead
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL, -- unix time
+            last_error TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (batch_id) REFERENCES Outbox_Batches (id) ON DELETE SET NULL)""",
+        "CREATE INDEX IF NOT EXISTS idx_outbox_due ON Outbox (status, next_attempt_at)",
+        "CREATE INDEX IF NOT EXISTS idx_outbox_batch ON Outbox (batch_id, status)",
+    ]),
+    (5, "key-value metadata", [
+        "CREATE TABLE IF NOT EXISTS Meta (key TEXT PRIMARY KEY, value TEXT)",
+    ]),
+    (6, "schedule source", [
+        # 'file' for schedules.json, 'manual' for /new_queue; reloads only touch 'file' rows.
+        # Rows that existed before are NULL until sync_schedules classifies them against the file
+        "ALTER TABLE Schedules ADD COLUMN source TEXT",
+    ]),
+    (7, "queue capacity", [
+        # NULL means DEFAULT_QUEUE_CAPACITY
+        "ALTER TABLE Schedules ADD COLUMN capacity INTEGER",
+    ]),
+    (8, "persisted bot state", [
+        # Keys and values are JSON; one row per key so only changed keys are written
+        """CREATE TABLE IF NOT EXISTS Persisted_User_Data (
+            user_id INTEGER NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            PRIMARY KEY (user_id, key))""",
+        "CREATE TABLE IF NOT EXISTS Persisted_Bot_Data (key TEXT PRIMARY KEY, value TEXT NOT NULL)",
+        """CREATE TABLE IF NOT EXISTS Persisted_Conversations (
+            name TEXT NOT NULL, -- ConversationHandler name
+            key TEXT NOT NULL, -- JSON list of chat and user ids
+            state TEXT NOT NULL,
+            PRIMARY KEY (name, key))""",
+    ]),
+]
+
+# Queries that must be served by an index: name -> (query, sample parameters).
+# Keep in sync with the corresponding Database methods.
+HOT_QUERIES = {
+    "get_taken_positions": ("SELECT position FROM Queues WHERE schedule_id = ?", (1,)),
+    "is_position_taken": ("SELECT 1 FROM Queues WHERE schedule_id = ? AND position = ?", (1, 1)),
+    "is_same_user_in_queue": ("SELECT COUNT(*) FROM Queues WHERE user_id = ? AND schedule_id = ? AND lab_number = ?",
+                              (1, 1, 1)),
+    "get_schedules_for_date": ("SELECT id FROM Schedules WHERE defense_date = ?", ("2024-01-01",)),
+    "get_schedules_with_subjects_for_date": ("SELECT id, subject, subgroup FROM Schedules WHERE defense_date = ?",
+                                             ("2024-01-01",)),
+    "get_user_queues": ("""SELECT s.id, s.subject, s.subgroup, s.defense_date, q.lab_number, q.position
+                           FROM Schedules s
+                           JOIN Queues q ON s.id = q.schedule_id
+                           WHERE q.user_id = ?""", (1,)),
+    "get_queue_with_users": ("""SELECT q.user_id, u.full_name, q.position, q.lab_number
+                                FROM Queues q
+                                JOIN Users u ON q.user_id = u.user_id
+                                WHERE q.schedule_id = ?
+                                ORDER BY q.position ASC""", (1,)),
+}
+
+# Plan steps that are fine without an index
+PLAN_SCANS_ALLOWED = {"SCAN CONSTANT ROW"}
+
+SET_META_QUERY = """INSERT INTO Meta (key, value) VALUES (?, ?)
+                    ON CONFLICT (key) DO UPDATE SET value = excluded.value"""
+SET_USER_DATA_QUERY = """INSERT INTO Persisted_User_Data (user_id, key, value) VALUES (?, ?, ?)
+                         ON CONFLICT (user_id, key) DO UPDATE SET value = excluded.value"""
+SET_BOT_DATA_QUERY = """INSERT INTO Persisted_Bot_Data (key, value) VALUES (?, ?)
+                        ON CONFLICT (key) DO UPDATE SET value = excluded.value"""
+
 
 class Database:
     def __init__(self, db_file):
-        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.pool = get_pool(db_file)
+        self.conn = self.pool.checkout()
         self.cursor = self.conn.cursor()
 
-        self.cursor.execute("PRAGMA foreign_keys = ON;")
-
     def __enter__(self):
         return self
 
@@ -21,7 +413,9 @@ class Database:
 
     def close(self):
         if hasattr(self, 'conn') and self.conn:
-            self.conn.close()
+            self.cursor.close()
+            self.pool.checkin(self.conn)
+            self.conn = None
 
     def create_database(self):
         """Creates database with all needed tables"""
@@ -59,16 +453,86 @@ class Database:
 
         self.__create_table("Settings", """registration_enabled INTEGER DEFAULT 1""")
 
+        self.migrate()
+
+    def get_schema_version(self) -> int:
+        self.__create_table("schema_version", """version INTEGER PRIMARY KEY,
+                        description TEXT,
+                        applied_at DATETIME DEFAULT CURRENT_TIMESTAMP""")
+        result = self.fetch("SELECT MAX(version) FROM schema_version")
+        return result[0][0] or 0
+
+    def migrate(self) -> int:
+        """
+        Applies pending MIGRATIONS in order, each in its own transaction.
+        Returns the resulting schema version.
+        """
+        current_version = self.get_schema_version()
+
+        for version, description, statements in MIGRATIONS:
+            if version <= current_version:
+                continue
+            try:
+                # sqlite3 doesn't open a transaction for DDL by itself, so ALTER TABLE would be
+                # committed on the spot: begin explicitly to roll the whole migration back on failure
+                self.cursor.execute("BEGIN IMMEDIATE")
+                for statement in statements:
+                    self.cursor.execute(statement)
+                self.cursor.execute("INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                                    (version, description))
+                self.conn.commit()
+            except sqlite3.Error as e:
+                self.conn.rollback()
+                raise DatabaseException(f"Migration {version} ({description}) failed: {e}")
+            current_version = version
+
+        return current_version
+
+    def check_query_plans(self) -> list[str]:
+        """
+        Runs EXPLAIN QUERY PLAN for HOT_QUERIES.
+        Returns a description of every hot query that still does a full table scan.
+        """
+        problems = []
+        for name, (query, parameters) in HOT_QUERIES.items():
+            plan = self.fetch(f"EXPLAIN QUERY PLAN {query}", parameters)
+            for row in plan:
+                detail = row[3]
+                if detail.startswith("SCAN ") and detail not in PLAN_SCANS_ALLOWED:
+                    problems.append(f"{name}: {detail}")
+        return problems
+
     def __create_table(self, table_name: str, fields: str):
         """Creates table"""
         query = f"""CREATE TABLE IF NOT EXISTS {table_name} ({fields})"""
         self.execute(query)
 
-    def execute(self, query: str, parameters: tuple = ()):
-        """Executes query"""
+    def execute(self, query: str, parameters: tuple = ()) -> int:
+        """Executes query and returns the number of affected rows"""
+        return self.run_in_transaction(lambda cursor: cursor.execute(query, parameters).rowcount)
+
+    def execute_many(self, query: str, seq_of_parameters) -> int:
+        """Executes query for every parameter tuple in one transaction"""
+        return self.run_in_transaction(lambda cursor: cursor.executemany(query, seq_of_parameters).rowcount)
+
+    def run_in_transaction(self, func):
+        """
+        Runs func(cursor) in a single write transaction and commits it.
+        Returns the result of func; on failure rolls back and raises DatabaseException.
+        func must not commit itself: with group commit it shares the transaction with other writes.
+        """
+        if _query_hooks:
+            transaction = func
+            func = lambda cursor: transaction(TimedCursor(cursor))
+
+        if self.pool.writer:
+            return self.pool.writer.submit(func)
+
         try:
-            self.cursor.execute(query, parameters)
+            self.cursor.execute("BEGIN IMMEDIATE")
+            result = func(self.cursor)
             self.conn.commit()
+            return result
         except sqlite3.Error as e:
             print(f"Query failed: {e}")
             self.conn.rollback()
@@ -76,8 +540,7 @@ class Database:
 
     def fetch(self, query: str, parameters: tuple = ()) -> list[tuple]:
         """Returns a list of query result"""
-        self.cursor.execute(query, parameters)
-        return self.cursor.fetchall()
+        return timed(self.conn, query, parameters, lambda: self.cursor.execute(query, parameters).fetchall())
 
     def get_queue_for_schedule(self, schedule_id: int):
         """
@@ -95,18 +558,40 @@ class Database:
                 """
         return self.fetch(query, (schedule_id,))
 
-    def add_user_to_queue(self, schedule_id: int, user_id: int, lab_number: int, position: int):
+    def add_user_to_queue(self, schedule_id: int, user_id: int, lab_number: int, position: int) -> bool:
+        """
+        Atomically claims a position in the queue.
+        Returns False if the position is already taken or is outside 1..capacity of the queue.
+        """
+        # The capacity check is part of the INSERT, so a concurrent /set_capacity can't slip in between
         query = """
                 INSERT INTO Queues (schedule_id, user_id, lab_number, position)
-                VALUES (?, ?, ?, ?)
+                SELECT id, ?, ?, ? FROM Schedules
+                WHERE id = ? AND ? BETWEEN 1 AND COALESCE(capacity, ?)
+                ON CONFLICT (schedule_id, position) DO NOTHING
                 """
-        self.execute(query, (schedule_id, user_id, lab_number, position))
+        parameters = (user_id, lab_number, position, schedule_id, position, DEFAULT_QUEUE_CAPACITY)
+        is_added = self.execute(query, parameters) == 1
+        if is_added:
+            queue_tables.invalidate(schedule_id)
+            taken_positions.take(schedule_id, position)
+        return is_added
 
     def remove_user_from_queue(self, schedule_id: int, user_id: int, lab_number: int):
-        query = """
-                DELETE FROM Queues WHERE schedule_id = ? AND user_id = ? AND lab_number = ?
-                """
-        self.execute(query, (schedule_id, user_id, lab_number))
+        condition = "schedule_id = ? AND user_id = ? AND lab_number = ?"
+        parameters = (schedule_id, user_id, lab_number)
+
+        def remove(cursor) -> list[int]:
+            # The freed positions are cleared in the taken positions bitmap
+            cursor.execute(f"SELECT position FROM Queues WHERE {condition}", parameters)
+            positions = [row[0] for row in cursor.fetchall()]
+            cursor.execute(f"DELETE FROM Queues WHERE {condition}", parameters)
+            return positions
+
+        positions = self.run_in_transaction(remove)
+        queue_tables.invalidate(schedule_id)
+        for position in positions:
+            taken_positions.release(schedule_id, position)
 
     def get_next_position(self, schedule_id: int) -> int:
         """Returns next free position in a queue"""
@@ -115,27 +600,125 @@ class Database:
         current_max = result[0][0] if result and result[0][0] is not None else 0
         return current_max + 1
 
-    def seed_initial_data(self):
-        data = parse_json("schedules.json")
-
-        for subject, subgroup, defense_date in data:
-            self.insert_defense_dates(subject, subgroup, defense_date)
+    def seed_initial_data(self, schedules_file: str = "schedules.json"):
+        if self.fetch("SELECT 1 FROM Schedules LIMIT 1"):
+            # The file may have been edited while the bot was down: apply the difference,
+            # inserting only the new rows would keep moved dates twice
+            if self.get_meta("schedules_hash") != file_hash(schedules_file):
+                self.sync_schedules(schedules_file)
+        else:
+            self.seed_schedules(schedules_file)
 
-        for name, user_id in admins.items():
-            self.execute("INSERT OR IGNORE INTO Users (user_id, full_name) VALUES (?, ?)", (user_id, name,))
+        self.execute_many("INSERT OR IGNORE INTO Users (user_id, full_name) VALUES (?, ?)",
+                          [(user_id, name) for name, user_id in admins.items()])
 
         settings_count = self.fetch("SELECT COUNT(*) FROM Settings")
         if settings_count and settings_count[0][0] == 0:
             self.execute("INSERT INTO Settings (registration_enabled) VALUES (1)")
 
-    def insert_defense_dates(self, subject: str, subgroup: str, defense_date: str):
-        parsed_date = datetime.strptime(defense_date, "%d.%m.%y")
-        formatted_date = parsed_date.strftime("%Y-%m-%d")
+    def seed_schedules(self, filename: str) -> bool:
+        """
+        Inserts all schedules from the file in one transaction, streaming records into executemany.
+        Skipped if the file has not changed since the last seeding. Returns True if it was seeded.
+        """
+        content_hash = file_hash(filename)
+        if self.get_meta("schedules_hash") == content_hash:
+            return False
+
+        query = """INSERT OR IGNORE INTO Schedules (subject, subgroup, defense_date, source) 
+               VALUES (?, ?, ?, 'file')"""
+        records = ((subject, subgroup, to_db_date(date)) for subject, subgroup, date in iter_schedules(filename))
+
+        def seed(cursor):
+            cursor.executemany(query, records)
+            cursor.execute(SET_META_QUERY, ("schedules_hash", content_hash))
+
+        self.run_in_transaction(seed)
+        return True
+
+    def get_meta(self, key: str) -> str | None:
+        result = self.fetch("SELECT value FROM Meta WHERE key = ?", (key,))
+        return result[0][0] if result else None
 
-        query = """INSERT OR IGNORE INTO Schedules (subject, subgroup, defense_date) 
-               VALUES (?, ?, ?)"""
+    def set_meta(self, key: str, value: str):
+        self.execute(SET_META_QUERY, (key, value))
 
-        self.execute(query, (subject, subgroup, formatted_date))
+    def sync_schedules(self, filename: str) -> tuple[int, int, int]:
+        """
+        Brings schedules loaded from the file in line with its current content in one transaction.
+        Only the difference is applied: a date changed for the same subject and subgroup is moved
+        in place (its queue is kept), new entries are inserted, entries gone from the file are deleted.
+        Unchanged and manually created schedules are not touched.
+        Unclassified rows (created before schedules had a source) are classified first: the ones
+        present in the file become 'file', the rest 'manual', so they are never deleted.
+        Returns (added, removed, moved) counts.
+        """
+        desired = {(subject, subgroup, to_db_date(date)) for subject, subgroup, date in iter_schedules(filename)}
+        content_hash = file_hash(filename)
+
+        def sync(cursor) -> tuple[int, list[int], list[int]]:
+            cursor.execute("SELECT id, subject, subgroup, defense_date, source FROM Schedules")
+            existing_keys = set()
+            file_rows = {}  # (subject, subgroup, defense_date) -> id
+            classified = []  # (source, id) of unclassified rows
+            for schedule_id, subject, subgroup, defense_date, source in cursor.fetchall():
+                key = (subject, subgroup, defense_date)
+                existing_keys.add(key)
+                if source is None:
+                    source = 'file' if key in desired else 'manual'
+                    classified.append((source, schedule_id))
+                if source == 'file':
+                    file_rows[key] = schedule_id
+            cursor.executemany("UPDATE Schedules SET source = ? WHERE id = ?", classified)
+
+            removed_dates = defaultdict(list)
+            for subject, subgroup, defense_date in file_rows.keys() - desired:
+                removed_dates[(subject, subgroup)].append(defense_date)
+
+            added_dates = defaultdict(list)
+            for subject, subgroup, defense_date in desired - existing_keys:
+                added_dates[(subject, subgroup)].append(defense_date)
+
+            # Pair removed and added dates of the same subject and subgroup into moves
+            moves, deletes, inserts = [], [], []
+            for group in removed_dates.keys() | added_dates.keys():
+                old_dates = sorted(removed_dates.get(group, []))
+                new_dates = sorted(added_dates.get(group, []))
+                for old_date, new_date in zip(old_dates, new_dates):
+                    moves.append((new_date, file_rows[(*group, old_date)]))
+                for old_date in old_dates[len(new_dates):]:
+                    deletes.append((file_rows[(*group, old_date)],))
+                for new_date in new_dates[len(old_dates):]:
+                    inserts.append((*group, new_date))
+
+            cursor.executemany("UPDATE Schedules SET defense_date = ? WHERE id = ?", moves)
+            cursor.executemany("DELETE FROM Schedules WHERE id = ?", deletes)
+            cursor.executemany("""INSERT INTO Schedules (subject, subgroup, defense_date, source)
+                                  VALUES (?, ?, ?, 'file')""", inserts)
+            cursor.execute(SET_META_QUERY, ("schedules_hash", content_hash))
+
+            return len(inserts), [schedule_id for schedule_id, in deletes], [schedule_id for _, schedule_id in moves]
+
+        added, deleted_ids, moved_ids = self.run_in_transaction(sync)
+
+        # Invalidated after the commit, so no reader can cache the old rows again in between
+        for schedule_id in moved_ids:
+            queue_tables.invalidate(schedule_id)
+        for schedule_id in deleted_ids:
+            queue_tables.invalidate(schedule_id)
+            taken_positions.invalidate(schedule_id)
+        # Moved dates and deleted schedules change the open queues
+        active_queues.invalidate()
+        return added, len(deleted_ids), len(moved_ids)
+
+    def insert_defense_dates(self, subject: str, subgroup: str, defense_date: str, source: str = "manual"):
+        formatted_date = to_db_date(defense_date)
+
+        query = """INSERT OR IGNORE INTO Schedules (subject, subgroup, defense_date, source) 
+               VALUES (?, ?, ?, ?)"""
+
+        self.execute(query, (subject, subgroup, formatted_date, source))
+        active_queues.invalidate()
 
     def is_registration_enabled(self) -> bool:
         query = "SELECT registration_enabled FROM Settings"
@@ -153,9 +736,16 @@ class Database:
         query = """INSERT INTO Users (user_id, full_name) 
                         VALUES (?, ?)"""
         self.execute(query, (user_id, full_name,))
+        registered_users.add(user_id)
 
-    def get_user_ids(self) -> list[int]:
+    def get_all_user_ids(self) -> list[int]:
+        """Returns ids of all registered users, including those who blocked the bot"""
         query = "SELECT user_id FROM Users"
+        return [row[0] for row in self.fetch(query)]
+
+    def get_user_ids(self) -> list[int]:
+        """Returns ids of users who have not blocked the bot"""
+        query = "SELECT user_id FROM Users WHERE is_blocked = 0"
         query_result = self.fetch(query)
         result = []
         for v in query_result:
@@ -163,6 +753,14 @@ class Database:
 
         return result
 
+    def mark_users_blocked(self, user_ids: list[int]):
+        query = "UPDATE Users SET is_blocked = 1 WHERE user_id = ?"
+        self.execute_many(query, [(user_id,) for user_id in user_ids])
+
+    def unblock_user(self, user_id: int):
+        query = "UPDATE Users SET is_blocked = 0 WHERE user_id = ? AND is_blocked = 1"
+        self.execute(query, (user_id,))
+
     def toggle_registration(self) -> int:
         if self.is_registration_enabled():
             query = """UPDATE Settings SET registration_enabled = ?"""
@@ -173,53 +771,57 @@ class Database:
             self.execute(query, (1,))
             return 1
         
-    def archive_past_queues(self, target_date: str) -> int:
+    def archive_past_queues(self, until_date: str) -> dict[int, int]:
         """
-        Finds open queues for the specified date, moves them to Archive, 
-        deletes them from Queues, and closes them (is_open = 0).
+        Archives every open queue with a defense date on or before until_date, so days
+        the bot was down are caught up too. In one transaction the queues are copied to Archive,
+        deleted from Queues and closed (is_open = 0).
+        Returns the number of archived rows per schedule: {schedule_id: count}.
         """
-        # Reading: Looking for schedules from yesterday that are still open
-        query_find = """
-            SELECT s.id 
+        # Open queues up to the date; is_open is cleared last, so the set stays the same
+        # for every statement of the transaction
+        eligible = """
+            SELECT s.id
             FROM Schedules s
             JOIN Active_Queues aq ON s.id = aq.schedule_id
-            WHERE s.defense_date = ? AND aq.is_open = 1
+            WHERE s.defense_date <= ? AND aq.is_open = 1
         """
-        schedules_to_archive = self.fetch(query_find, (target_date,))
-        
-        if not schedules_to_archive:
-            return 0
-            
-        count = 0
-        for row in schedules_to_archive:
-            schedule_id = row[0]
-            try:
-                # Data Migration: Copy to archive
-                query_migrate = """
-                    INSERT INTO Archive (schedule_id, user_id, lab_number, position)
-                    SELECT schedule_id, user_id, lab_number, position
-                    FROM Queues
-                    WHERE schedule_id = ?
-                """
-                self.cursor.execute(query_migrate, (schedule_id,))
-                
-                # Cleaning: Delete from the worksheet
-                query_clean = "DELETE FROM Queues WHERE schedule_id = ?"
-                self.cursor.execute(query_clean, (schedule_id,))
-                
-                # Closing: Change the status to closed
-                query_close = "UPDATE Active_Queues SET is_open = 0 WHERE schedule_id = ?"
-                self.cursor.execute(query_close, (schedule_id,))
-                
-                # Commit a transaction for a specific queue
-                self.conn.commit()
-                count += 1
-                
-            except sqlite3.Error as e:
-                self.conn.rollback() # We cancel changes if there was an error
-                raise DatabaseException(f"Помилка архівування черги {schedule_id}: {e}")
-                
-        return count
+
+        def archive(cursor) -> dict[int, int]:
+            query_count = f"""
+                SELECT e.id, COUNT(q.id)
+                FROM ({eligible}) e
+                LEFT JOIN Queues q ON q.schedule_id = e.id
+                GROUP BY e.id
+            """
+            cursor.execute(query_count, (until_date,))
+            counts = dict(cursor.fetchall())
+            if not counts:
+                return counts
+
+            # Data Migration: Copy to archive
+            query_migrate = f"""
+                INSERT INTO Archive (schedule_id, user_id, lab_number, position)
+                SELECT schedule_id, user_id, lab_number, position
+                FROM Queues
+                WHERE schedule_id IN ({eligible})
+            """
+            cursor.execute(query_migrate, (until_date,))
+
+            # Cleaning: Delete from the worksheet
+            cursor.execute(f"DELETE FROM Queues WHERE schedule_id IN ({eligible})", (until_date,))
+
+            # Closing: Change the status to closed
+            cursor.execute(f"UPDATE Active_Queues SET is_open = 0 WHERE schedule_id IN ({eligible})", (until_date,))
+            return counts
+
+        archived = self.run_in_transaction(archive)
+        for schedule_id in archived:
+            queue_tables.invalidate(schedule_id)
+            taken_positions.invalidate(schedule_id)
+        if archived:
+            active_queues.invalidate()
+        return archived
 
     def get_schedules_for_date(self, target_date: str) -> list[int]:
         """
@@ -231,21 +833,32 @@ class Database:
 
         return [row[0] for row in results]
 
+    def get_schedules_with_subjects_for_date(self, target_date: str) -> list[tuple]:
+        """
+        Retrieves schedules for a specific date ('YYYY-MM-DD').
+        Format of the result: [(id, subject, subgroup), ...]
+        """
+        query = "SELECT id, subject, subgroup FROM Schedules WHERE defense_date = ?"
+        return self.fetch(query, (target_date,))
+
     def update_active_queues(self, schedule_id: int) -> None:
         if schedule_id:
-            query = """SELECT COUNT(*) FROM Active_Queues WHERE schedule_id = ?"""
-            res = self.fetch(query, (schedule_id,))
-            if res[0][0] != 0:
-                query = """UPDATE Active_Queues SET is_open = ? WHERE schedule_id = ?"""
-                self.execute(query, (1, schedule_id))
-            else:
-                query = """INSERT INTO Active_Queues (schedule_id, is_open) VALUES (?, ?)"""
-                self.execute(query, (schedule_id, 1))
-
-    def get_subject_name_and_subgroup(self, schedule_id: int) -> tuple[str, str]:
+            self.open_active_queues([schedule_id])
+
+    def open_active_queues(self, schedule_ids: list[int]) -> None:
+        """Opens (or reopens) queues for all schedules in one transaction"""
+        query = """
+            INSERT INTO Active_Queues (schedule_id, is_open) VALUES (?, 1)
+            ON CONFLICT (schedule_id) DO UPDATE SET is_open = 1
+        """
+        self.execute_many(query, [(schedule_id,) for schedule_id in schedule_ids])
+        active_queues.invalidate()
+
+    def get_subject_name_and_subgroup(self, schedule_id: int) -> tuple[str, str] | None:
+        """(subject, subgroup), or None if the schedule no longer exists"""
         query = """SELECT subject, subgroup FROM Schedules WHERE id = ?"""
         res = self.fetch(query, (schedule_id,))
-        return res[0][0], res[0][1]
+        return (res[0][0], res[0][1]) if res else None
 
     def get_current_active_queues(self) -> list[tuple]:
         query = """
@@ -270,6 +883,18 @@ class Database:
         result = self.fetch(query, (schedule_id,))
         return [row[0] for row in result]
 
+    def get_queue_slots(self, schedule_id: int) -> tuple[int, list[int]]:
+        """Returns (capacity, taken positions) of the queue"""
+        capacity = self.fetch("SELECT COALESCE(capacity, ?) FROM Schedules WHERE id = ?",
+                              (DEFAULT_QUEUE_CAPACITY, schedule_id))
+        return (capacity[0][0] if capacity else 0), self.get_taken_positions(schedule_id)
+
+    def set_queue_capacity(self, schedule_id: int, capacity: int) -> bool:
+        """Sets how many positions the queue has. Returns False if there is no such schedule"""
+        is_updated = self.execute("UPDATE Schedules SET capacity = ? WHERE id = ?", (capacity, schedule_id)) == 1
+        taken_positions.invalidate(schedule_id)
+        return is_updated
+
     def is_position_taken(self, schedule_id: int, position: int) -> bool:
         query = "SELECT 1 FROM Queues WHERE schedule_id = ? AND position = ?"
         result = self.fetch(query, (schedule_id, position))
@@ -297,10 +922,118 @@ class Database:
     def close_active_queue(self, schedule_id:int):
         query = "UPDATE Active_Queues SET is_open = 0 WHERE schedule_id = ?"
         self.execute(query, (schedule_id,))
+        queue_tables.invalidate(schedule_id)
+        active_queues.invalidate()
+
+    def enqueue_messages(self, messages: list[tuple], progress_message: tuple[int, int] = None) -> int:
+        """
+        Stores messages in the Outbox in one transaction.
+        messages: [(chat_id, text, reply_markup_json or None), ...]
+        progress_message: (chat_id, message_id) of a message that shows delivery progress of the batch.
+        Returns the number of enqueued messages.
+        """
+        now = time.time()
+
+        def enqueue(cursor) -> int:
+            batch_id = None
+            if progress_message:
+                cursor.execute("INSERT INTO Outbox_Batches (chat_id, message_id, total) VALUES (?, ?, ?)",
+                               (*progress_message, len(messages)))
+                batch_id = cursor.lastrowid
+
+            query = """INSERT INTO Outbox (chat_id, text, reply_markup, batch_id, next_attempt_at)
+                       VALUES (?, ?, ?, ?, ?)"""
+            cursor.executemany(query, [(chat_id, text, markup, batch_id, now) for chat_id, text, markup in messages])
+            return len(messages)
+
+        return self.run_in_transaction(enqueue)
+
+    def get_due_messages(self, limit: int) -> list[tuple]:
+        """
+        Returns pending Outbox messages whose next attempt is due.
+        Format of the result: [(id, chat_id, text, reply_markup, batch_id, attempts), ...]
+        """
+        query = """
+            SELECT id, chat_id, text, reply_markup, batch_id, attempts
+            FROM Outbox
+            WHERE status = 'pending' AND next_attempt_at <= ?
+            ORDER BY id
+            LIMIT ?
+        """
+        return self.fetch(query, (time.time(), limit))
+
+    def update_outbox_messages(self, results: list[tuple]):
+        """results: [(status, attempts, next_attempt_at, last_error, id), ...]"""
+        query = """UPDATE Outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?
+                   WHERE id = ?"""
+        self.execute_many(query, results)
+
+    def get_batches_progress(self, batch_ids: list[int]) -> list[tuple]:
+        """
+        Returns delivery progress of Outbox batches.
+        Format of the result: [(batch_id, chat_id, message_id, total, sent, blocked, dead), ...]
+        """
+        placeholders = ", ".join("?" * len(batch_ids))
+        query = f"""
+            SELECT b.id, b.chat_id, b.message_id, b.total,
+                   SUM(o.status = 'sent'), SUM(o.status = 'blocked'), SUM(o.status = 'dead')
+            FROM Outbox_Batches b
+            JOIN Outbox o ON o.batch_id = b.id
+            WHERE b.id IN ({placeholders})
+            GROUP BY b.id
+        """
+        return self.fetch(query, tuple(batch_ids))
+
+    def purge_outbox(self, older_than_days: int) -> int:
+        """Deletes delivered and dead-lettered messages older than the given number of days"""
+        query = """DELETE FROM Outbox
+                   WHERE status != 'pending' AND created_at < datetime('now', ?)"""
+        deleted = self.execute(query, (f"-{older_than_days} days",))
+        self.execute("DELETE FROM Outbox_Batches WHERE id NOT IN (SELECT batch_id FROM Outbox WHERE batch_id IS NOT NULL)")
+        return deleted
 
     def reschedule_queue(self, schedule_id: int, new_date: str):
-        parsed_date = datetime.strptime(new_date, "%d.%m.%y")
-        formatted_date = parsed_date.strftime("%Y-%m-%d")
+        formatted_date = to_db_date(new_date)
 
         query = "UPDATE Schedules SET defense_date = ? WHERE id = ?"
-        self.execute(query, (formatted_date, schedule_id))
\ No newline at end of file
+        self.execute(query, (formatted_date, schedule_id))
+        active_queues.invalidate()
+
+    def load_user_data(self, user_id: int) -> list[tuple[str, str]]:
+        """Persisted user_data of one user as [(JSON key, JSON value), ...]"""
+        return self.fetch("SELECT key, value FROM Persisted_User_Data WHERE user_id = ?", (user_id,))
+
+    def save_user_data(self, user_id: int, changed: list[tuple[str, str]], removed: list[str]):
+        """Writes changed (key, value) pairs and deletes removed keys of a user's data in one transaction"""
+        def save(cursor):
+            cursor.executemany(SET_USER_DATA_QUERY, [(user_id, key, value) for key, value in changed])
+            cursor.executemany("DELETE FROM Persisted_User_Data WHERE user_id = ? AND key = ?",
+                               [(user_id, key) for key in removed])
+
+        self.run_in_transaction(save)
+
+    def delete_user_data(self, user_id: int):
+        self.execute("DELETE FROM Persisted_User_Data WHERE user_id = ?", (user_id,))
+
+    def load_bot_data(self) -> list[tuple[str, str]]:
+        return self.fetch("SELECT key, value FROM Persisted_Bot_Data")
+
+    def save_bot_data(self, changed: list[tuple[str, str]], removed: list[str]):
+        """Writes changed (key, value) pairs and deletes removed keys of bot_data in one transaction"""
+        def save(cursor):
+            cursor.executemany(SET_BOT_DATA_QUERY, changed)
+            cursor.executemany("DELETE FROM Persisted_Bot_Data WHERE key = ?", [(key,) for key in removed])
+
+        self.run_in_transaction(save)
+
+    def load_conversations(self, name: str) -> list[tuple[str, str]]:
+        """States of a ConversationHandler as [(JSON key, JSON state), ...]"""
+        return self.fetch("SELECT key, state FROM Persisted_Conversations WHERE name = ?", (name,))
+
+    def save_conversation(self, name: str, key: str, state: str | None):
+        """Stores the state of one conversation; None means the conversation ended"""
+        if state is None:
+            self.execute("DELETE FROM Persisted_Conversations WHERE name = ? AND key = ?", (name, key))
+        else:
+            self.execute("""INSERT INTO Persisted_Conversations (name, key, state) VALUES (?, ?, ?)
+                            ON CONFLICT (name, key) DO UPDATE SET state = excluded.state""", (name, key, state))
@@ -0,0 +1,53 @@
+import time
+
+from collections import OrderedDict
+
+from metrics import Counter
+
+duplicate_callbacks = Counter("bot_duplicate_callbacks_total", "Repeated button taps dropped before their handler",
+                              ("prefix",))
+
+
+class RecentCallbacks:
+    """
+    Remembers (user, message_id, callback data) of the taps seen during the last `window` seconds,
+    at most max_size of them, oldest first, so a repeated tap on the same button can be recognized.
+    """
+    def __init__(self, prefixes: tuple[str, ...], window: float, max_size: int = 10000):
+        self.prefixes = prefixes
+        self.window = window
+        self.max_size = max_size
+        self._seen = OrderedDict()  # key -> monotonic time of the first tap
+
+    def is_duplicate(self, user_id: int, message_id: int, data: str) -> bool:
+        """Records the tap; True if the same tap was already seen within the window"""
+        prefix = next((prefix for prefix in self.prefixes if data.startswith(prefix)), None)
+        if prefix is None:
+            return False
+
+        now = time.monotonic()
+        self._expire(now)
+
+        key = (user_id, message_id, data)
+        if key in self._seen:
+            duplicate_callbacks.inc(prefix=prefix)
+            return True
+
+        self._seen[key] = now
+        if len(self._seen) > self.max_size:
+            self._seen.popitem(last=False)
+        return False
+
+    def forget(self, user_id: int, message_id: int, data: str):
+        """Forgets a tap whose handling failed, so the user can retry it right away"""
+        self._seen.pop((user_id, message_id, data), None)
+
+    def _expire(self, now: float):
+        while self._seen:
+            key, seen_at = next(iter(self._seen.items()))
+            if now - seen_at < self.window:
+                break
+            del self._seen[key]
+
+    def __len__(self):
+        return len(self._seen)
@@ -0,0 +1,121 @@
+import asyncio
+import json
+import time
+
+from telegram import InlineKeyboardMarkup
+from telegram.error import TelegramError
+
+from config import (OUTBOX_BATCH_SIZE, OUTBOX_MAX_ATTEMPTS, OUTBOX_BACKOFF_BASE, OUTBOX_BACKOFF_MAX,
+                    BROADCAST_PROGRESS_INTERVAL)
+from async_database import AsyncDatabase
+from sender import MessageSender, SENT, BLOCKED
+
+# Outbox statuses
+PENDING = "pending"
+DEAD = "dead"  # gave up after OUTBOX_MAX_ATTEMPTS
+
+
+async def enqueue(db_file: str, messages: list[tuple], progress_message=None) -> int:
+    """
+    Stores messages for the worker to send and returns how many were enqueued.
+    messages: [(chat_id, text), ...] or [(chat_id, text, InlineKeyboardMarkup), ...]
+    progress_message: telegram Message that the worker edits with delivery progress.
+    """
+    rows = []
+    for chat_id, text, *markup in messages:
+        reply_markup = markup[0].to_json() if markup and markup[0] else None
+        rows.append((chat_id, text, reply_markup))
+
+    progress = (progress_message.chat_id, progress_message.message_id) if progress_message else None
+    return await AsyncDatabase(db_file).enqueue_messages(rows, progress)
+
+
+def backoff(attempts: int) -> float:
+    """Seconds before the next attempt after `attempts` failed ones"""
+    return min(OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1), OUTBOX_BACKOFF_MAX)
+
+
+def format_progress(total: int, sent: int, blocked: int, dead: int) -> str:
+    done = sent + blocked + dead
+    title = "📢 Розсилку завершено!" if done >= total else f"📢 Розсилка: {done}/{total}"
+    return (f"{title}\n\n"
+            f"✅ Успішно надіслано: {sent}\n"
+            f"🚫 Заблокували бота: {blocked}\n"
+            f"❌ Помилок: {dead}")
+
+
+class OutboxWorker:
+    """
+    Drains the Outbox table: sends due messages in batches, retries failures with exponential
+    backoff, dead-letters messages after OUTBOX_MAX_ATTEMPTS and marks users who blocked the bot.
+    Pending rows survive restarts, so interrupted mass sends resume where they stopped.
+    """
+    def __init__(self):
+        self._lock = asyncio.Lock()
+        self._progress_edited_at = {}  # batch_id -> time of the last progress edit
+
+    async def drain(self, bot, db_file: str) -> int:
+        """Sends due messages until none are left, returns the number of processed messages"""
+        async with self._lock:
+            processed = 0
+            while True:
+                count = await self._drain_batch(bot, db_file)
+                processed += count
+                if count < OUTBOX_BATCH_SIZE:
+                    return processed
+
+    async def _drain_batch(self, bot, db_file: str) -> int:
+        db = AsyncDatabase(db_file)
+        rows = await db.get_due_messages(OUTBOX_BATCH_SIZE)
+        if not rows:
+            return 0
+
+        sender = MessageSender(bot)
+        results = await asyncio.gather(*(self._deliver(sender, bot, row) for row in rows))
+
+        await db.update_outbox_messages(results)
+
+        blocked_ids = [row[1] for row, result in zip(rows, results) if result[0] == BLOCKED]
+        if blocked_ids:
+            await db.mark_users_blocked(blocked_ids)
+
+        batch_ids = {row[4] for row in rows if row[4] is not None}
+        if batch_ids:
+            await self._show_progress(bot, db, batch_ids)
+
+        return len(rows)
+
+    @staticmethod
+    async def _deliver(sender: MessageSender, bot, row: tuple) -> tuple:
+        outbox_id, chat_id, text, reply_markup, _, attempts = row
+
+        kwargs = {}
+        if reply_markup:
+            kwargs["reply_markup"] = InlineKeyboardMarkup.de_json(json.loads(reply_markup), bot)
+
+        status, error = await sender.send(chat_id, text, **kwargs)
+        attempts += 1
+
+        if status in (SENT, BLOCKED):
+            return status, attempts, time.time(), error, outbox_id
+        if attempts >= OUTBOX_MAX_ATTEMPTS:
+            return DEAD, attempts, time.time(), error, outbox_id
+        return PENDING, attempts, time.time() + backoff(attempts), error, outbox_id
+
+    async def _show_progress(self, bot, db: AsyncDatabase, batch_ids: set[int]):
+        now = time.monotonic()
+        for batch_id, chat_id, message_id, total, sent, blocked, dead in await db.get_batches_progress(list(batch_ids)):
+            is_finished = sent + blocked + dead >= total
+            if not is_finished and now - self._progress_edited_at.get(batch_id, 0) < BROADCAST_PROGRESS_INTERVAL:
+                continue
+
+            self._progress_edited_at[batch_id] = now
+            if is_finished:
+                del self._progress_edited_at[batch_id]
+
+            try:
+                await bot.edit_message_text(format_progress(total, sent, blocked, dead),
+                                            chat_id=chat_id, message_id=message_id)
+            except TelegramError:
+                pass
+
@@ -0,0 +1,130 @@
+import json
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from config import PERSISTENCE_UPDATE_INTERVAL
+from async_database import AsyncDatabase
+
+
+def _dump(value) -> str:
+    return json.dumps(value, ensure_ascii=False, sort_keys=True)
+
+
+def _serialize(data: dict) -> dict[str, str]:
+    """{key: value} -> {JSON key: JSON value}; JSON keys keep int keys (user ids) ints after loading"""
+    return {_dump(key): _dump(value) for key, value in data.items()}
+
+
+def _deserialize(rows) -> dict:
+    return {json.loads(key): json.loads(value) for key, value in rows}
+
+
+def _diff(old: dict[str, str], new: dict[str, str]) -> tuple[list[tuple[str, str]], list[str]]:
+    """Keys to write and keys to delete to turn old into new"""
+    changed = [(key, value) for key, value in new.items() if old.get(key) != value]
+    removed = [key for key in old if key not in new]
+    return changed, removed
+
+
+class SQLitePersistence(BasePersistence):
+    """
+    Keeps user_data, bot_data and conversation states in the bot's SQLite database,
+    one row per key, so pending registrations and half-finished flows survive restarts.
+
+    user_data is not read at startup: a user's rows are loaded on the first update from them.
+    Writes store only the keys that changed since the last write. Values must be JSON-serializable.
+    """
+    def __init__(self, db_file: str, update_interval: float = PERSISTENCE_UPDATE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=True, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.db = AsyncDatabase(db_file)
+
+        # What the database holds, serialized: the base for the next diff
+        self._user_snapshots = {}  # user_id -> {key: value}
+        self._bot_snapshot = {}
+
+    # Loading
+
+    async def get_user_data(self) -> dict:
+        # Loaded per user in refresh_user_data
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: dict):
+        if user_id in self._user_snapshots:
+            return
+
+        rows = await self.db.load_user_data(user_id)
+        if user_id in self._user_snapshots:
+            # Another update of the user loaded it meanwhile
+            return
+
+        self._user_snapshots[user_id] = dict(rows)
+        for key, value in _deserialize(rows).items():
+            user_data.setdefault(key, value)
+
+    async def get_bot_data(self) -> dict:
+        rows = await self.db.load_bot_data()
+        self._bot_snapshot = dict(rows)
+        return _deserialize(rows)
+
+    async def get_conversations(self, name: str) -> dict:
+        return {tuple(json.loads(key)): json.loads(state) for key, state in await self.db.load_conversations(name)}
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    # Saving
+
+    async def update_user_data(self, user_id: int, data: dict):
+        if user_id not in self._user_snapshots:
+            # Touched without an update from the user (e.g. by a job): diff against what is stored
+            self._user_snapshots[user_id] = dict(await self.db.load_user_data(user_id))
+
+        new = _serialize(data)
+        changed, removed = _diff(self._user_snapshots[user_id], new)
+        if changed or removed:
+            await self.db.save_user_data(user_id, changed, removed)
+        self._user_snapshots[user_id] = new
+
+    async def drop_user_data(self, user_id: int):
+        await self.db.delete_user_data(user_id)
+        self._user_snapshots.pop(user_id, None)
+
+    async def update_bot_data(self, data: dict):
+        new = _serialize(data)
+        changed, removed = _diff(self._bot_snapshot, new)
+        if changed or removed:
+            await self.db.save_bot_data(changed, removed)
+        self._bot_snapshot = new
+
+    async def update_conversation(self, name: str, key: tuple, new_state):
+        state = None if new_state is None else _dump(new_state)
+        await self.db.save_conversation(name, _dump(list(key)), state)
+
+    # Not stored: the bot doesn't use chat_data or arbitrary callback data
+
+    async def update_chat_data(self, chat_id: int, data: dict):
+        pass
+
+    async def drop_chat_data(self, chat_id: int):
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict):
+        # bot_data is loaded once at startup and only changed by this process
+        pass
+
+    async def flush(self):
+        # Nothing is buffered here: the Application calls the update_* methods every update_interval
+        # seconds and once more on shutdown, so a crash loses at most the changes of the last interval
+        pass
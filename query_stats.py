@@ -0,0 +1,168 @@
+import queue
+import re
+import sqlite3
+import threading
+import time
+
+from functools import lru_cache
+
+from config import DB_SLOW_QUERY_MS, DB_SLOW_QUERY_LOG
+
+# Upper bounds of the latency histogram buckets, ms
+BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, float("inf"))
+
+_WHITESPACE = re.compile(r"\s+")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)+\s*\)", re.IGNORECASE)
+
+
+@lru_cache(maxsize=1024)
+def normalize_query(query: str) -> str:
+    """Query text with literals replaced by ? and IN lists collapsed, so the same statement is counted once"""
+    query = _WHITESPACE.sub(" ", query).strip()
+    query = _STRING.sub("?", query)
+    query = _NUMBER.sub("?", query)
+    return _IN_LIST.sub("IN (?, ...)", query)
+
+
+class QueryEntry:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * len(BUCKETS_MS)
+
+    def percentile(self, p: float) -> float:
+        """Upper bound of the bucket holding the p-th percentile (0-100)"""
+        rank = p / 100 * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS_MS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+
+class QueryStats:
+    """
+    Query hook for database.add_query_hook.
+    Aggregates count, errors and a latency histogram per normalized query, and appends statements
+    slower than slow_ms to the slow-query log together with their EXPLAIN QUERY PLAN.
+    The plan is taken and the log written by a background thread on its own connection to db_file,
+    never on the caller's connection, which may be in the middle of a write transaction.
+    """
+    def __init__(self, slow_ms: float = DB_SLOW_QUERY_MS, slow_log: str | None = DB_SLOW_QUERY_LOG,
+                 db_file: str | None = None):
+        self.slow_ms = slow_ms
+        self.slow_log = slow_log
+        self.db_file = db_file
+        self.slow_count = 0
+        self.started_at = time.time()
+
+        self._entries = {}  # normalized query -> QueryEntry
+        self._lock = threading.Lock()
+
+        self._slow_queries = queue.Queue(maxsize=1000)  # (logged_at, query, parameters, elapsed_ms)
+        self._logger = None
+
+    def __call__(self, conn: sqlite3.Connection, query: str, parameters, seconds: float, error: Exception | None):
+        elapsed_ms = seconds * 1000
+        key = normalize_query(query)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = QueryEntry()
+            entry.count += 1
+            entry.total_ms += elapsed_ms
+            entry.max_ms = max(entry.max_ms, elapsed_ms)
+            entry.buckets[next(i for i, bound in enumerate(BUCKETS_MS) if elapsed_ms <= bound)] += 1
+            if error:
+                entry.errors += 1
+
+            is_slow = elapsed_ms >= self.slow_ms and not error
+            if is_slow:
+                self.slow_count += 1
+                if self._logger is None:
+                    self._logger = threading.Thread(target=self._log_slow_queries, name="slow-query-log",
+                                                    daemon=True)
+                    self._logger.start()
+
+        if is_slow:
+            # executemany passes a sequence of parameter tuples; the plan doesn't depend on the values
+            if isinstance(parameters, (tuple, list)):
+                parameters = tuple(parameters)
+            elif isinstance(parameters, dict):
+                parameters = dict(parameters)
+            else:
+                parameters = (None,) * query.count("?")
+            try:
+                self._slow_queries.put_nowait((time.time(), query, parameters, elapsed_ms))
+            except queue.Full:
+                # The log is behind: the statement is still counted in slow_count
+                pass
+
+    def _log_slow_queries(self):
+        conn = None
+        while True:
+            logged_at, query, parameters, elapsed_ms = self._slow_queries.get()
+            try:
+                if conn is None:
+                    if self.db_file is None:
+                        raise sqlite3.Error("файл бази не задано")
+                    conn = sqlite3.connect(self.db_file)
+                plan = [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", parameters).fetchall()]
+            except sqlite3.Error as e:
+                plan = [f"(план недоступний: {e})"]
+
+            line = (f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(logged_at))} {elapsed_ms:.1f} ms: "
+                    f"{normalize_query(query)}\n" + "".join(f"    {step}\n" for step in plan))
+            try:
+                if self.slow_log:
+                    with open(self.slow_log, "a", encoding="utf-8") as log:
+                        log.write(line)
+                else:
+                    print(f"Повільний запит: {line}", end="")
+            except OSError as e:
+                print(f"Не вдалося записати повільний запит: {e}")
+
+    def snapshot(self) -> list[tuple[str, QueryEntry]]:
+        """(normalized query, copy of its entry) sorted by total time, most expensive first"""
+        with self._lock:
+            entries = []
+            for key, entry in self._entries.items():
+                copy = QueryEntry()
+                copy.__dict__.update(entry.__dict__, buckets=list(entry.buckets))
+                entries.append((key, copy))
+        return sorted(entries, key=lambda item: item[1].total_ms, reverse=True)
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+            self.slow_count = 0
+            self.started_at = time.time()
+
+    def format_snapshot(self, top: int = 10, query_length: int = 120) -> str:
+        entries = self.snapshot()
+        if not entries:
+            return "Запитів до бази ще не було."
+
+        total_count = sum(entry.count for _, entry in entries)
+        total_ms = sum(entry.total_ms for _, entry in entries)
+        minutes = (time.time() - self.started_at) / 60
+
+        lines = [f"📊 Запити до бази за {minutes:.0f} хв: {total_count}, разом {total_ms:.0f} мс, "
+                 f"повільних (≥{self.slow_ms:g} мс): {self.slow_count}\n"]
+        for query, entry in entries[:top]:
+            if len(query) > query_length:
+                query = query[:query_length - 1] + "…"
+            lines.append(f"{query}\n"
+                         f"  ×{entry.count}, разом {entry.total_ms:.0f} мс, "
+                         f"сер. {entry.total_ms / entry.count:.2f} мс, p95 ≤{entry.percentile(95):.1f} мс, "
+                         f"макс. {entry.max_ms:.1f} мс" + (f", помилок: {entry.errors}" if entry.errors else ""))
+        return "\n".join(lines)
+
+
+query_stats = QueryStats()
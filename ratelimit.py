@@ -0,0 +1,50 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at `rate` tokens per second, holding at most `capacity` tokens.
+    Not thread-safe: use it from the event loop only.
+    """
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated_at
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """Takes tokens if they are available right now"""
+        now = time.monotonic()
+        if now < self.paused_until:
+            return False
+
+        self._refill(now)
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    def wait_time(self, tokens: float = 1) -> float:
+        """Seconds until `tokens` become available"""
+        now = time.monotonic()
+        self._refill(now)
+        missing = max(0.0, tokens - self.tokens)
+        return max(self.paused_until - now, missing / self.rate)
+
+    async def acquire(self, tokens: float = 1):
+        """Waits until tokens are available and takes them"""
+        while not self.try_acquire(tokens):
+            await asyncio.sleep(self.wait_time(tokens))
+
+    def pause(self, seconds: float):
+        """Hands out no tokens for the next `seconds` (e.g. after a flood-control response)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
@@ -1,14 +1,31 @@
+import hashlib
 import json
 
-def parse_json(filename: str) -> list:
+from datetime import datetime
+from functools import lru_cache
+
+
+def iter_schedules(filename: str):
+    """Yields (subject, subgroup, defense_date) records one by one"""
     with open(filename, 'r') as sch_file:
         data = json.load(sch_file)
 
-    final_data_list = []
-
     for subgroup, subject_dict in data.items():
         for subject_name, date_list in subject_dict.items():
             for date in date_list:
-                final_data_list.append([subject_name, subgroup, date])
+                yield subject_name, subgroup, date
+
+
+def file_hash(filename: str) -> str:
+    """SHA-256 of the file content"""
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as sch_file:
+        for chunk in iter(lambda: sch_file.read(65536), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
 
-    return final_data_list
\ No newline at end of file
+@lru_cache(maxsize=4096)
+def to_db_date(date: str) -> str:
+    """'DD.MM.YY' -> 'YYYY-MM-DD'. Raises ValueError on a malformed date"""
+    return datetime.strptime(date, "%d.%m.%y").strftime("%Y-%m-%d")
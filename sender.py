@@ -0,0 +1,75 @@
+import asyncio
+import time
+
+from datetime import timedelta
+
+from telegram.error import Forbidden, RetryAfter, TelegramError
+
+from config import BROADCAST_CONCURRENCY, SEND_RATE_PER_SECOND, SEND_RATE_PER_CHAT, SEND_MAX_RETRIES
+from ratelimit import TokenBucket
+from metrics import messages_sent
+
+# Send outcomes
+SENT = "sent"
+BLOCKED = "blocked"
+FAILED = "failed"
+
+# Shared by every sender in the process: Telegram limits the bot as a whole
+_global_bucket = TokenBucket(SEND_RATE_PER_SECOND, SEND_RATE_PER_SECOND)
+_chat_next_send: dict[int, float] = {}
+
+
+def _seconds(retry_after) -> float:
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+async def _wait_for_chat(chat_id: int):
+    """Keeps sends to one chat at most SEND_RATE_PER_CHAT per second"""
+    now = time.monotonic()
+    next_send = _chat_next_send.get(chat_id, now)
+    _chat_next_send[chat_id] = max(now, next_send) + 1 / SEND_RATE_PER_CHAT
+
+    if next_send > now:
+        await asyncio.sleep(next_send - now)
+
+    # Forget chats whose slot has already passed
+    if len(_chat_next_send) > 10000:
+        for stale_id in [cid for cid, t in _chat_next_send.items() if t < now]:
+            del _chat_next_send[stale_id]
+
+
+class MessageSender:
+    """
+    Sends messages with bounded concurrency, the global and per-chat rate limits
+    and automatic waiting on flood-control (RetryAfter) responses.
+    """
+    def __init__(self, bot, concurrency: int = BROADCAST_CONCURRENCY):
+        self.bot = bot
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(self, chat_id: int, text: str, **kwargs) -> tuple[str, str | None]:
+        """Sends one message and returns (SENT, BLOCKED or FAILED, error description)"""
+        async with self._semaphore:
+            for _ in range(SEND_MAX_RETRIES + 1):
+                await _global_bucket.acquire()
+                await _wait_for_chat(chat_id)
+                try:
+                    await self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                    messages_sent.inc(outcome=SENT)
+                    return SENT, None
+                except RetryAfter as e:
+                    # Flood control applies to the whole bot, so everyone waits
+                    messages_sent.inc(outcome="retry_after")
+                    _global_bucket.pause(_seconds(e.retry_after))
+                except Forbidden as e:
+                    messages_sent.inc(outcome=BLOCKED)
+                    return BLOCKED, str(e)
+                except TelegramError as e:
+                    print(f"Помилка відправки користувачу {chat_id}: {e}")
+                    messages_sent.inc(outcome=FAILED)
+                    return FAILED, str(e)
+
+            messages_sent.inc(outcome=FAILED)
+            return FAILED, "flood control retries exhausted"
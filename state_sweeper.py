@@ -0,0 +1,87 @@
+import sys
+import time
+
+from collections import OrderedDict
+
+from metrics import Counter, Gauge
+
+state_entries = Gauge("bot_state_entries", "Entries held in process memory", ("kind",))
+state_bytes = Gauge("bot_state_bytes", "Approximate size of the state held in process memory", ("kind",))
+state_evicted = Counter("bot_state_evicted_total", "State entries dropped by the sweeper", ("kind",))
+
+
+def deep_sizeof(obj, seen: set = None) -> int:
+    """sys.getsizeof of obj and everything in its dicts, lists, tuples and sets, each object counted once"""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(key, seen) + deep_sizeof(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    return size
+
+
+class StateSweeper:
+    """
+    Decides which per-user state to drop.
+    Remembers when each user was last active, least recently active first, and picks
+    users idle longer than user_data_ttl, then the least recently active ones beyond max_users
+    (only among those idle for at least min_idle, so a dialog in progress is never cut off).
+    """
+    def __init__(self, user_data_ttl: float, max_users: int, min_idle: float):
+        self.user_data_ttl = user_data_ttl
+        self.max_users = max_users
+        self.min_idle = min_idle
+        self._last_seen = OrderedDict()  # user_id -> monotonic time, least recent first
+
+    def touch(self, user_id: int):
+        self._last_seen[user_id] = time.monotonic()
+        self._last_seen.move_to_end(user_id)
+
+    def forget(self, user_id: int):
+        self._last_seen.pop(user_id, None)
+
+    def users_to_evict(self, user_data) -> list[int]:
+        """
+        Users whose entries in user_data (application.user_data) should be dropped.
+        Idle users that have no entry there hold no state: they are only forgotten here.
+        """
+        now = time.monotonic()
+        for user_id in user_data:
+            # State created without an update from the user: count it as fresh
+            if user_id not in self._last_seen:
+                self.touch(user_id)
+
+        evict, stateless = [], []
+        over_limit = len(user_data) - self.max_users
+        for user_id, last_seen in self._last_seen.items():
+            idle = now - last_seen
+            if not (idle >= self.user_data_ttl or (over_limit > len(evict) and idle >= self.min_idle)):
+                break
+            if user_id in user_data:
+                evict.append(user_id)
+            else:
+                stateless.append(user_id)
+
+        for user_id in stateless:
+            self.forget(user_id)
+        return evict
+
+    @staticmethod
+    def expired_registrations(bot_data, ttl: float) -> list[int]:
+        """Users whose pending registration requests in bot_data are older than ttl seconds"""
+        now = time.time()
+        expired = []
+        for user_id, request in bot_data.items():
+            if not isinstance(user_id, int):
+                continue
+            # Requests made before they were timestamped start their time now
+            requested_at = request.setdefault("requested_at", now)
+            if now - requested_at >= ttl:
+                expired.append(user_id)
+        return expired
@@ -0,0 +1,73 @@
+from collections import OrderedDict
+
+from telegram import Update
+
+from metrics import Counter
+from ratelimit import TokenBucket
+
+throttled_updates = Counter("bot_throttled_total", "Updates rejected by the throttle before reaching a handler",
+                            ("rule",))
+
+
+class Throttle:
+    """
+    Rate limits for commands and callback buttons.
+    rules maps "/command" or a callback data prefix to (rate, burst); every user gets
+    a bucket per rule, and all throttled updates of all users share one global bucket.
+    Updates no rule matches are never throttled.
+    """
+    def __init__(self, rules: dict[str, tuple[float, float]], global_rate: float, global_burst: float,
+                 max_buckets: int = 10000):
+        self.rules = rules
+        self.commands = {key for key in rules if key.startswith("/")}
+        # Longest first, so a prefix never shadows a longer one
+        self.prefixes = sorted((key for key in rules if not key.startswith("/")), key=len, reverse=True)
+        self.max_buckets = max_buckets
+
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self._buckets = OrderedDict()  # (user_id, rule) -> TokenBucket, least recently used first
+        self._warned = set()  # (user_id, rule) told about the limit since their last allowed action
+
+    def rule_for(self, update: Update) -> str | None:
+        if update.callback_query and update.callback_query.data:
+            data = update.callback_query.data
+            return next((prefix for prefix in self.prefixes if data.startswith(prefix)), None)
+
+        if update.message and update.message.text and update.message.text.startswith("/"):
+            command = update.message.text.split(maxsplit=1)[0].split("@", 1)[0]
+            return command if command in self.commands else None
+
+        return None
+
+    def check(self, user_id: int, rule: str) -> bool:
+        """Takes a token for the user's action; False if the action must be rejected"""
+        key = (user_id, rule)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(*self.rules[rule])
+            if len(self._buckets) > self.max_buckets:
+                # The least recently used bucket has been idle the longest, so it would be full anyway
+                evicted, _ = self._buckets.popitem(last=False)
+                self._warned.discard(evicted)
+        else:
+            self._buckets.move_to_end(key)
+
+        if not bucket.try_acquire():
+            throttled_updates.inc(rule=rule)
+            return False
+        if not self.global_bucket.try_acquire():
+            # Give the user's token back: the rejection is not their fault
+            bucket.tokens += 1
+            throttled_updates.inc(rule="global")
+            return False
+
+        self._warned.discard(key)
+        return True
+
+    def should_warn(self, user_id: int, rule: str) -> bool:
+        """True for the first rejection since the user's last allowed action, so the user is told only once"""
+        key = (user_id, rule)
+        if key in self._warned:
+            return False
+        self._warned.add(key)
+        return True
@@ -0,0 +1,112 @@
+import asyncio
+import contextlib
+import time
+
+from collections import Counter
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from metrics import Gauge, Histogram
+
+updates_waiting = Gauge("bot_updates_waiting", "Updates waiting for their user's previous update or a free slot")
+updates_processing = Gauge("bot_updates_processing", "Updates being processed right now")
+update_wait = Histogram("bot_update_wait_seconds", "Time an update waited before its processing started")
+user_backlog_max = Gauge("bot_user_backlog_max", "Largest number of queued updates of a single user")
+
+# PTB's own limit only bounds the number of update tasks; the real limit is the processor's semaphore,
+# taken after the per-user lock so updates waiting behind their user don't hold a slot
+MAX_PENDING_UPDATES = 4096
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes updates of different users concurrently, at most `concurrency` at a time,
+    while updates of one user run strictly one after another in arrival order.
+    That keeps ConversationHandler state and user_data consistent: a user's callback never
+    overtakes the message that moved the conversation into its state.
+    """
+    def __init__(self, concurrency: int):
+        super().__init__(MAX_PENDING_UPDATES)
+        self.concurrency = concurrency
+        self._slots = asyncio.BoundedSemaphore(concurrency)
+        self._user_locks = {}  # key -> [asyncio.Lock, number of updates holding or waiting for it]
+        self._backlogs = Counter()  # number of updates of a key -> how many keys have that many
+        self._backlog_max = 0
+
+    @staticmethod
+    def _key(update: object):
+        """Updates with the same key are serialized; conversations are per user, so the user is the key"""
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user:
+            return "user", update.effective_user.id
+        if update.effective_chat:
+            return "chat", update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine):
+        queued_at = time.perf_counter()
+        key = self._key(update)
+        lock = self._lock_for(key) if key else contextlib.nullcontext()
+
+        updates_waiting.inc()
+        is_waiting = True
+        try:
+            async with lock, self._slots:
+                updates_waiting.dec()
+                is_waiting = False
+                update_wait.observe(time.perf_counter() - queued_at)
+
+                updates_processing.inc()
+                try:
+                    await coroutine
+                finally:
+                    updates_processing.dec()
+        finally:
+            if is_waiting:
+                updates_waiting.dec()
+            if key:
+                self._release(key)
+
+    def _lock_for(self, key) -> asyncio.Lock:
+        entry = self._user_locks.get(key)
+        if entry is None:
+            entry = self._user_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        self._update_backlog(entry[1] - 1, entry[1])
+        return entry[0]
+
+    def _release(self, key):
+        entry = self._user_locks[key]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._user_locks[key]
+        self._update_backlog(entry[1] + 1, entry[1])
+
+    def _update_backlog(self, old: int, new: int):
+        """
+        Moves a key from count old to count new and keeps the gauge at the largest count,
+        so it goes down as users' backlogs drain. Counts change by one, so this is O(1).
+        """
+        if old:
+            self._backlogs[old] -= 1
+            if not self._backlogs[old]:
+                del self._backlogs[old]
+        if new:
+            self._backlogs[new] += 1
+
+        if new > self._backlog_max:
+            self._backlog_max = new
+        elif old == self._backlog_max and old not in self._backlogs:
+            # The only key(s) with the largest count went down by one
+            self._backlog_max = new
+        else:
+            return
+        user_backlog_max.set(self._backlog_max)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass